@@ -13,10 +13,14 @@ def cli():
 
 @cli.command(name='build')
 @click.option('--clean', '-c', is_flag=True)
-def build_command(clean):
+@click.option('--staged', is_flag=True)
+def build_command(clean, staged):
 
     config = Config.from_file(mode='build')
-    build.build(config, clean)
+    if staged:
+        build.build_staged(config, clean)
+    else:
+        build.build(config, clean)
 
 
 @cli.command(name='serve')
@@ -1,6 +1,9 @@
+import os
 from pathlib import Path
 import shutil
 import tempfile
+import threading
+import time
 
 from livereload import Server
 
@@ -20,11 +23,123 @@ def build(config: Config, clean=False):
 
     public_dir.mkdir(exist_ok=True)
     site.output()
+    site.print_build_stats()
+    return site
+
+
+def build_staged(config: Config, clean=False):
+    """Build into a staging dir next to public_dir, then swap it in.
+
+    The staging dir starts as hardlinks to the current output, or empty
+    with clean, and the old output is removed in the background.
+    """
+    public_dir = config.public_dir
+    staging_dir = get_staging_dir(public_dir)
+    prepare_staging_dir(staging_dir, None if clean else public_dir)
+
+    config.public_dir = staging_dir
+    config['output_root'] = public_dir
+    config['replace_outputs'] = True
+    try:
+        site = build(config)
+    finally:
+        config.public_dir = public_dir
+        config['output_root'] = None
+        config['replace_outputs'] = False
+
+    swap_dirs(staging_dir, public_dir)
+    return site
+
+
+def get_staging_dir(public_dir: Path):
+    return public_dir.with_name(f'.{public_dir.name}.staging')
+
+
+def link_or_copy(src, dest):
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+def prepare_staging_dir(staging_dir: Path, seed_dir: Path = None):
+    if staging_dir.exists():
+        # left by a build that failed
+        shutil.rmtree(staging_dir)
+
+    if seed_dir is not None and seed_dir.is_dir():
+        shutil.copytree(seed_dir, staging_dir, symlinks=True,
+                        copy_function=link_or_copy)
+    else:
+        staging_dir.mkdir(parents=True)
+
+
+def swap_dirs(staging_dir: Path, public_dir: Path):
+    """Move staging_dir to public_dir; the old public_dir is removed in
+    a daemon thread, and what an exit interrupts is removed next time.
+
+    If the staging dir cannot be moved, the old public_dir is put back.
+    """
+    # including trees left by builds that exited before removing them
+    old_dirs = list(public_dir.parent.glob(f'.{public_dir.name}.old-*'))
+    old_dir = None
+    if public_dir.exists():
+        old_dir = public_dir.with_name(
+            f'.{public_dir.name}.old-{os.getpid()}-{time.time_ns()}')
+        os.rename(public_dir, old_dir)
+    try:
+        os.rename(staging_dir, public_dir)
+    except OSError:
+        if old_dir is not None:
+            os.rename(old_dir, public_dir)
+        raise
+    if old_dir is not None:
+        old_dirs.append(old_dir)
+
+    def remove_dirs():
+        for old_dir in old_dirs:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    thread = threading.Thread(target=remove_dirs, daemon=True)
+    thread.start()
+    return thread
+
+
+def rebuild(site: Site, changed, added, deleted):
+    if site.update_paths(changed, added, deleted):
+        return site
+    return build(site.config)
+
+
+def scan_files(paths):
+    files = {}
+    for path in map(Path, paths):
+        targets = [path] if path.is_file() else path.glob('**/*')
+        for f in targets:
+            if f.is_file():
+                files[f] = f.stat().st_mtime
+    return files
 
 
 def start_server(config: Config, watch_paths, port=5500):
+    state = {'site': None, 'files': {}}
+
     def reload():
-        build(config)
+        old_files = state['files']
+        new_files = scan_files(watch_paths)
+        state['files'] = new_files
+
+        if state['site'] is None:
+            state['site'] = build(config)
+            return
+
+        changed = {
+            f for f in new_files.keys() & old_files.keys()
+            if new_files[f] != old_files[f]
+        }
+        added = new_files.keys() - old_files.keys()
+        deleted = old_files.keys() - new_files.keys()
+        state['site'] = rebuild(state['site'], changed, added, deleted)
 
     reload()
 
@@ -4,6 +4,9 @@ from nkssg.structure.plugins import BasePlugin
 
 
 class AutoPPlugin(BasePlugin):
+
+    process_safe = True
+
     def on_get_content(self, doc, config, single, **kwargs):
         if single.ext in ["html", "htm", "txt"]:
             content = markdown.markdown(doc, extensions=['nl2br'])
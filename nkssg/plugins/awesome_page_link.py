@@ -15,6 +15,11 @@ class AwesomePageLinkPlugin(BasePlugin):
         re.I | re.S
     )
 
+    def __init__(self):
+        super().__init__()
+        # page.id -> (page, content before its links were replaced)
+        self.sources = {}
+
     def after_update_urls(self, site: Site, **kwargs):
         mode = site.config.get('mode') or 'draft'
         if mode == 'draft':
@@ -24,9 +29,13 @@ class AwesomePageLinkPlugin(BasePlugin):
         self.keyword = self.config.get('keyword', '?')
         self.strip_paths = self.config.get('strip_paths', [])
 
-        for page in site.singles:
-            self.update_page_link(page)
-        for page in site.archives:
+        # pages kept from the last update get their links resolved again,
+        # so they follow the current urls of the pages they link to
+        sources, self.sources = self.sources, {}
+        for page in [*site.singles, *site.archives]:
+            page_source = sources.get(page.id)
+            if page_source is not None and page_source[0] is page:
+                page.content = page_source[1]
             self.update_page_link(page)
         return site
 
@@ -38,6 +47,7 @@ class AwesomePageLinkPlugin(BasePlugin):
         if not any(keyword + quote in page.content for quote in ['"', "'"]):
             return
 
+        self.sources[page.id] = (page, page.content)
         replacers = []
 
         for tag in AwesomePageLinkPlugin.href_pattern.finditer(page.content):
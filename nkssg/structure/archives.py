@@ -1,11 +1,31 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path, PurePath
+import re
 
+import jinja2
+
+from nkssg.structure.cache import FileCache
 from nkssg.structure.config import Config, TermConfig
+from nkssg.structure.environment import record_dependencies
+from nkssg.structure.minify import minify_html
 from nkssg.structure.plugins import Plugins
 from nkssg.structure.pages import Pages, Page
 from nkssg.structure.singles import Singles, Single
 from nkssg.structure.themes import Themes
+from nkssg.structure.workers import (
+    can_fork, get_counters, get_worker_count, map_in_forks)
+
+
+# template code that reads what can change when singles outside the page
+# slice change: the members of the archive being rendered, or the page list
+# and totals of its paginator. Other archives are read through the site
+# globals, which update_docs invalidates on its own.
+READS_PATTERNS = {
+    'members': re.compile(
+        r'\bmypage\s*(?:\.\s*|\[\s*[\'"])singles'),
+    'paging': re.compile(
+        r'\bpaginator\s*(?:\.\s*|\[\s*[\'"])(?:pages|total_)'),
+}
 
 
 class Archives(Pages):
@@ -14,6 +34,9 @@ class Archives(Pages):
         self.plugins = plugins
         self.archives: dict[PurePath, Archive] = {}
         self.long_ids: dict[PurePath, PurePath] = {}  # for taxonomy
+        self.archive_pages: dict[PurePath, list[Page]] = {}
+        self.page_keys: dict[PurePath, tuple[frozenset, list[str]]] = {}
+        self.rendered_pages: set[Page] = set()
         self.pages = []
 
         global_root_archive = Archive(None, '/')
@@ -120,6 +143,11 @@ class Archives(Pages):
     def add_singles_to_taxonomy_archives(self, singles: Singles):
         taxonomy_root_archive = self.create_archive(PurePath('/taxonomy'))
         for root_name in taxonomy_root_archive.children:
+            term_ids = self.get_term_ids(root_name)
+            term_archives: dict[str, Archive] = {}
+            members: dict[PurePath, set] = {}
+            not_found: dict[str, list] = {}
+
             for single in singles:
                 if single.meta.get(root_name) is None:
                     continue
@@ -127,18 +155,66 @@ class Archives(Pages):
                     single.meta[root_name] = [single.meta[root_name]]
 
                 for term in single.meta[root_name]:
-                    short_id = PurePath('/taxonomy', root_name, term)
-                    if short_id not in self.long_ids:
-                        print(f'{root_name}: {term} is not found ({single})')
-                        continue
-
-                    id = self.long_ids[short_id]
-                    archive = self.create_archive(id)
-                    if single not in archive.singles:
+                    archive = term_archives.get(term)
+                    if archive is None:
+                        if term not in term_ids:
+                            short_id = PurePath('/taxonomy', root_name, term)
+                            term_ids[term] = self.long_ids.get(short_id)
+                        id = term_ids[term]
+                        if id is None:
+                            not_found.setdefault(term, []).append(single)
+                            continue
+                        archive = term_archives[term] = self.create_archive(id)
+
+                    archive_members = members.get(archive.id)
+                    if archive_members is None:
+                        archive_members = members[archive.id] = set(archive.singles)
+                    if single not in archive_members:
+                        archive_members.add(single)
                         archive.singles.append(single)
                         single.archive_list.append(archive)
 
+            for term, pages in not_found.items():
+                others = f' and {len(pages) - 1} more' if len(pages) > 1 else ''
+                print(f'{root_name}: {term} is not found ({pages[0]}{others})')
+
+    def get_term_ids(self, root_name):
+        """Return term name -> long archive id for one taxonomy."""
+        return {
+            short_id.parts[3]: long_id
+            for short_id, long_id in self.long_ids.items()
+            if len(short_id.parts) == 4 and short_id.parts[2] == root_name
+        }
+
     def update_singles_all(self):
+        """Collect the singles of each archive and its descendants.
+
+        Every leaf is merged up to its root as before, in the same order,
+        but membership is checked against a set and each merge only reads
+        the part of a list that was appended since the last merge.
+        """
+        seen = {}     # archive id -> (singles_all, set of its singles)
+        merged = {}   # (archive id, source) -> (singles_all, source list, count)
+
+        def merge(archive: Archive, key, singles: list):
+            entry = seen.get(archive.id)
+            if entry is None or entry[0] is not archive.singles_all:
+                entry = (archive.singles_all, set(archive.singles_all))
+                seen[archive.id] = entry
+            singles_all, members = entry
+
+            state = merged.get((archive.id, key))
+            start = 0
+            if state and state[0] is singles_all and state[1] is singles:
+                start = state[2]
+
+            for i in range(start, len(singles)):
+                single = singles[i]
+                if single not in members:
+                    members.add(single)
+                    singles_all.append(single)
+            merged[(archive.id, key)] = (singles_all, singles, len(singles))
+
         for archive in self.archives.values():
             if len(archive.id.parts) <= 2 or archive.children:
                 continue
@@ -149,13 +225,8 @@ class Archives(Pages):
                 current = self.create_archive(current_id)
                 parent = self.create_archive(current_id.parent)
 
-                for single in parent.singles:
-                    if single not in parent.singles_all:
-                        parent.singles_all.append(single)
-
-                for single in current.singles_all:
-                    if single not in parent.singles_all:
-                        parent.singles_all.append(single)
+                merge(parent, None, parent.singles)
+                merge(parent, current.id, current.singles_all)
                 current_id = current_id.parent
 
     def link_section_archive_to_single(self, singles: Singles):
@@ -215,29 +286,174 @@ class Archives(Pages):
         self.plugins.do_action(
             'after_update_archives_url', target=self)
 
-    def update_htmls(self, singles: Singles, themes: Themes):
+    def update_htmls(self, singles: Singles, themes: Themes, archives=None,
+                     reuse=False):
+        """Render the archive pages.
+
+        With reuse, a pagination page whose key (slice of singles and
+        paginator state) is unchanged keeps its previous html.
+        """
         self.plugins.do_action('before_update_archives_html', target=self)
 
         self.link_section_archive_to_single(singles)
 
-        def render_archive_html(archive: Archive):
-            self.pages += archive.get_archive_pages(self.config, themes)
+        if archives is None:
+            archives = list(self.archives.values())
+            self.archive_pages = {}
+            self.page_keys = {}
 
-        with ThreadPoolExecutor() as executor:
-            futures = [
-                executor.submit(render_archive_html, archive)
-                for archive in self.archives.values()
-            ]
-            for future in as_completed(futures):
-                try:
-                    future.result()
-                except Exception as e:
-                    print(f"Exception during archive HTML rendering: {e}")
+        tasks, paginators = self.get_render_tasks(archives, reuse)
+
+        use_processes = self.config.parallel.render_processes
+        if use_processes and can_fork() and len(tasks) > 1:
+            results = self._render_tasks_in_processes(tasks, themes)
+        else:
+            results = self._render_tasks_in_threads(tasks, themes)
+        self._set_archive_pages(tasks, results, paginators)
+
+        self.pages = [
+            page
+            for id in self.archives
+            for page in self.archive_pages.get(id, [])
+        ]
 
         self.plugins.do_action('after_update_archives_html', target=self)
 
+    def get_render_tasks(self, archives, reuse=False):
+        """Return the (archive, paginator, target_singles, index) tasks of
+        the pages to render, in archive order, and for each archive
+        (archive, paginator, target_singles, reads, page keys)."""
+        dependencies = getattr(self.config.env, 'dependencies', None)
+        self._digests = {}
+        template_reads = {}
+
+        tasks = []
+        paginators = []
+        for archive in archives:
+            paginator, target_singles = archive.get_paginator(self.config)
+            if paginator is None:
+                paginators.append((archive, None, None, None, []))
+                continue
+
+            reads = self._get_reads(archive, template_reads)
+            keys = archive.get_page_keys(
+                paginator, target_singles, self._get_digest, reads)
+            paginators.append((archive, paginator, target_singles, reads, keys))
+
+            old_reads, old_keys = self.page_keys.get(archive.id, (reads, []))
+            if old_reads != reads:
+                old_keys = []
+            old_pages = self.archive_pages.get(archive.id, [])
+
+            archive_tasks = []
+            for i, key in enumerate(keys):
+                if reuse and i < len(old_keys) and i < len(old_pages) \
+                        and old_keys[i] == key:
+                    paginator['pages'][i].html = old_pages[i].html
+                else:
+                    archive_tasks.append((archive, paginator, target_singles, i))
+
+            # every page records its templates again, unless some are reused
+            if dependencies is not None and len(archive_tasks) == len(keys):
+                dependencies.set(archive.id, set())
+            tasks += archive_tasks
+        return tasks, paginators
+
+    def _get_digest(self, single: Single):
+        digest = self._digests.get(single.id)
+        if digest is None:
+            digest = self._digests[single.id] = single.get_digest()
+        return digest
+
+    def _get_reads(self, archive: 'Archive', cache: dict):
+        """Return which of READS_PATTERNS the templates of the archive
+        match; unknown templates are assumed to match all of them."""
+        env = self.config.env
+        dependencies = getattr(env, 'dependencies', None)
+        names = dependencies.pages.get(archive.id) if dependencies else None
+        if not names:
+            return frozenset(READS_PATTERNS)
+
+        reads = set()
+        for name in names:
+            if name not in cache:
+                try:
+                    source, _, _ = env.loader.get_source(env, name)
+                except jinja2.TemplateError:
+                    cache[name] = frozenset(READS_PATTERNS)
+                else:
+                    cache[name] = frozenset(
+                        kind for kind, pattern in READS_PATTERNS.items()
+                        if pattern.search(source))
+            reads |= cache[name]
+        return frozenset(reads)
+
+    def _set_archive_pages(self, tasks, results, paginators):
+        failed = set()
+        self.rendered_pages = set()
+        for (archive, paginator, _, i), html in zip(tasks, results):
+            if html is None:
+                failed.add(archive.id)
+                continue
+            paginator['pages'][i].html = html
+            self.rendered_pages.add(paginator['pages'][i])
+
+        template_reads = {}
+        for archive, paginator, target_singles, reads, keys in paginators:
+            if archive.id in failed:
+                continue
+            if paginator is None:
+                self.archive_pages[archive.id] = []
+                self.page_keys[archive.id] = (reads, [])
+                continue
+
+            # the templates are known once the archive has been rendered
+            new_reads = self._get_reads(archive, template_reads)
+            if new_reads != reads:
+                reads = new_reads
+                keys = archive.get_page_keys(
+                    paginator, target_singles, self._get_digest, reads)
+            self.archive_pages[archive.id] = paginator['pages']
+            self.page_keys[archive.id] = (reads, keys)
+
+    def _render_task(self, task, themes: Themes):
+        archive, paginator, target_singles, i = task
+        try:
+            with record_dependencies(self.config.env, archive.id, merge=True):
+                return archive.render_archive_page(
+                    self.config, themes, paginator, target_singles, i)
+        except Exception as e:
+            print(f"Exception during archive HTML rendering: {e}")
+            return None
+
+    def _render_tasks_in_threads(self, tasks, themes: Themes):
+        with ThreadPoolExecutor() as executor:
+            return list(executor.map(
+                lambda task: self._render_task(task, themes), tasks))
+
+    def _render_tasks_in_processes(self, tasks, themes: Themes):
+        dependencies = getattr(self.config.env, 'dependencies', None)
+
+        def render(task):
+            html = self._render_task(task, themes)
+            archive_id = task[0].id
+            names = dependencies.pages.get(archive_id) if dependencies else None
+            return html, names
+
+        workers = get_worker_count(self.config)
+        results = map_in_forks(
+            render, tasks, workers, get_counters(self.config))
+
+        for task, (_, names) in zip(tasks, results):
+            if names is not None:
+                dependencies.merge(task[0].id, names)
+        return [html for html, _ in results]
+
 
 class Archive(Page):
+    __slots__ = (
+        'parent', 'parents', 'children', 'singles', 'singles_all', 'single',
+    )
 
     def __init__(self, parent: 'Archive', name):
         super().__init__()
@@ -274,10 +490,67 @@ class Archive(Page):
     def singles_all_count(self):
         return len(self.singles_all) if self.singles_all is not None else 0
 
+    def _get_key_parts(self):
+        parent = self.parent
+        parent = (str(parent.id), parent.title, parent.url) if parent else None
+        children = [
+            (str(child.id), child.title, child.url, child.singles_all_count)
+            for child in self.children.values()
+        ]
+        return [str(self.id), self.title, self.url, str(self.dest_path),
+                self.content, parent, children]
+
+    def get_render_key(self, digests: dict):
+        members = [
+            [digests.get(single.id, '') for single in singles]
+            for singles in (self.singles, self.singles_all)
+        ]
+        return FileCache.make_key(*self._get_key_parts(), members)
+
+    def get_page_keys(self, paginator: dict, target_singles: list,
+                      get_digest, reads=frozenset(READS_PATTERNS)):
+        """Return a render key for each page of the paginator.
+
+        A key covers the archive, the page's place in the paginator and
+        the singles in its slice. With 'members' in reads it also covers
+        all members, and with 'paging' the totals and the page urls.
+        """
+        base = self._get_key_parts()
+        if 'members' in reads:
+            base.append([
+                [get_digest(single) for single in singles]
+                for singles in (self.singles, self.singles_all)
+            ])
+        if 'paging' in reads:
+            base.append(paginator['total_elements'])
+            base.append(paginator['total_pages'])
+            base.append([page.url for page in paginator['pages']])
+
+        keys = []
+        for i, page in enumerate(paginator['pages']):
+            start, end = self.get_page_range(paginator, i)
+            has_next = i < paginator['total_pages'] - 1
+            keys.append(FileCache.make_key(
+                *base, i, page.url, has_next,
+                paginator['limit'], paginator['first_limit'],
+                [get_digest(single) for single in target_singles[start:end]]))
+        return keys
+
     def get_archive_pages(self, config: Config, themes: Themes):
+        paginator, target_singles = self.get_paginator(config)
+        if paginator is None:
+            return []
+
+        for i in range(paginator['total_pages']):
+            self.render_archive_page(
+                config, themes, paginator, target_singles, i)
+        return paginator['pages']
 
+    def get_paginator(self, config: Config):
+        """Return (paginator, target_singles) with the archive pages set up
+        but not rendered, or (None, None) when there is nothing to render."""
         if not self.shouldUpdateHtml or self.singles_all_count == 0:
-            return []
+            return None, None
 
         if self.archive_type == 'date':
             target_singles = self.singles_all
@@ -330,37 +603,49 @@ class Archive(Page):
         paginator['total_pages'] = len(paginator['pages'])
         paginator['first'] = paginator['pages'][0]
         paginator['last'] = paginator['pages'][-1]
+        return paginator, target_singles
 
-        for i in range(paginator['total_pages']):
-            if i == 0:
-                start = 0
-                end = min(first_limit, total_elements)
-            else:
-                start = end
-                end = min(start + limit, total_elements)
-
-            paginator['paged'] = i + 1
-            paginator['prev'] = None
-            paginator['next'] = None
-
-            paginator['has_prev'] = (i > 0)
-            if paginator['has_prev']:
-                paginator['prev'] = paginator['pages'][i - 1]
-
-            paginator['has_next'] = (i < paginator['total_pages'] - 1)
-            if paginator['has_next']:
-                paginator['next'] = paginator['pages'][i + 1]
-
-            template_file = self.lookup_template(themes)
-            template = config.env.get_template(template_file)
-
-            paginator['pages'][i].html = template.render({
-                'mypage': self,
-                'pages': target_singles[start:end],
-                'paginator': paginator,
-                })
-
-        return paginator['pages']
+    @staticmethod
+    def get_page_range(paginator: dict, i: int):
+        first_limit = paginator['first_limit']
+        limit = paginator['limit']
+        total_elements = paginator['total_elements']
+        if i == 0:
+            return 0, min(first_limit, total_elements)
+        start = min(first_limit + (i - 1) * limit, total_elements)
+        return start, min(start + limit, total_elements)
+
+    def render_archive_page(self, config: Config, themes: Themes,
+                            paginator: dict, target_singles: list, i: int):
+        """Render the i-th page of the paginator and return its html."""
+        start, end = self.get_page_range(paginator, i)
+
+        # each page gets its own copy, so pages can be rendered in any order
+        paginator = dict(paginator)
+        paginator['paged'] = i + 1
+        paginator['prev'] = None
+        paginator['next'] = None
+
+        paginator['has_prev'] = (i > 0)
+        if paginator['has_prev']:
+            paginator['prev'] = paginator['pages'][i - 1]
+
+        paginator['has_next'] = (i < paginator['total_pages'] - 1)
+        if paginator['has_next']:
+            paginator['next'] = paginator['pages'][i + 1]
+
+        template_file = self.lookup_template(themes)
+        template = config.env.get_template(template_file)
+
+        html = template.render({
+            'mypage': self,
+            'pages': target_singles[start:end],
+            'paginator': paginator,
+            })
+        if config.output.minify_html:
+            html = minify_html(html)
+        paginator['pages'][i].html = html
+        return html
 
     def lookup_template(self, themes: Themes):
         prefix = f'archive-{self.archive_type}'
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import pickle
+import tempfile
+import threading
+
+
+def write_atomic(path: Path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp')
+    try:
+        if isinstance(data, bytes):
+            f = os.fdopen(fd, 'wb')
+        else:
+            f = os.fdopen(fd, 'w', encoding='UTF-8')
+        with f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except OSError:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+
+class CacheStats:
+    """Thread-safe hit and miss counters shared by the caches."""
+
+    name = ''
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        return f'{self.name} cache: {self.hits} hits, {self.misses} misses'
+
+
+class FileCache(CacheStats):
+    """Content-addressed text store under ``{cache_dir}/{name}/``."""
+
+    def __init__(self, cache_dir: Path, name: str):
+        super().__init__()
+        self.name = name
+        self.dir = Path(cache_dir) / name
+
+    @staticmethod
+    def make_key(*parts):
+        h = hashlib.sha256()
+        for part in parts:
+            if not isinstance(part, str):
+                part = json.dumps(part, sort_keys=True, default=str)
+            h.update(part.encode('UTF-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _get_path(self, key: str):
+        return self.dir / key[:2] / key
+
+    def get(self, key: str):
+        try:
+            value = self._get_path(key).read_text(encoding='UTF-8')
+        except OSError:
+            value = None
+
+        self.count(value is not None)
+        return value
+
+    def set(self, key: str, value: str):
+        try:
+            write_atomic(self._get_path(key), value)
+        except OSError as e:
+            print(f'Warning: failed to write {self.name} cache: {e}')
+
+
+def get_manifest_path(config, name):
+    """Path of the ``name`` manifest that describes public_dir.
+
+    Staged builds write into a staging dir but set ``output_root`` to the
+    public_dir it replaces, so they share manifests with in-place builds.
+    Serve and draft write to a new temporary dir each time, so their
+    manifests stay in memory and None is returned.
+    """
+    if config.get('mode') in ('serve', 'draft'):
+        return None
+    output_root = config.get('output_root') or config.public_dir
+    key = FileCache.make_key(str(output_root))[:16]
+    return config.cache_dir / name / f'{key}.json'
+
+
+class OutputManifest:
+    """Hashes of the files written to ``public_dir`` by previous builds."""
+
+    def __init__(self, path: Path, public_dir: Path):
+        self.path = Path(path) if path else None
+        self.public_dir = Path(public_dir)
+        self.hashes: dict[str, str] = {}
+        self.written = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, name='output'):
+        manifest = cls(get_manifest_path(config, name), config.public_dir)
+        manifest.load()
+        return manifest
+
+    def load(self):
+        if self.path is None:
+            self.hashes = {}
+            return
+        try:
+            self.hashes = json.loads(self.path.read_text(encoding='UTF-8'))
+        except (OSError, ValueError):
+            self.hashes = {}
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            text = json.dumps(self.hashes, sort_keys=True)
+        try:
+            write_atomic(self.path, text)
+        except OSError as e:
+            print(f'Warning: failed to write output manifest: {e}')
+
+    def _get_key(self, output_path: Path):
+        try:
+            return Path(output_path).relative_to(self.public_dir).as_posix()
+        except ValueError:
+            return Path(output_path).as_posix()
+
+    def is_changed(self, output_path: Path, text):
+        key = self._get_key(output_path)
+        data = text if isinstance(text, bytes) else text.encode('UTF-8')
+        digest = hashlib.sha256(data).hexdigest()
+
+        with self._lock:
+            if self.hashes.get(key) == digest and Path(output_path).exists():
+                self.skipped += 1
+                return False
+            self.hashes[key] = digest
+            self.written += 1
+            return True
+
+    def stats(self):
+        return f'output: {self.written} written, {self.skipped} unchanged'
+
+
+class MetadataIndex(CacheStats):
+    """Front matter and derived fields of each doc, keyed by path.
+
+    An entry is used only while the file keeps the same size and mtime,
+    and the whole index is dropped when the fingerprint changes. Saves
+    are atomic, so build and serve can share the file.
+    """
+
+    name = 'metadata'
+    version = 1
+
+    def __init__(self, path: Path, fingerprint: str):
+        super().__init__()
+        self.path = Path(path)
+        self.fingerprint = fingerprint
+        self.entries: dict[str, tuple] = {}
+        self.changed = False
+
+    @classmethod
+    def from_config(cls, config):
+        key = FileCache.make_key(str(config.docs_dir))[:16]
+        fingerprint = FileCache.make_key(cls.version, config.post_type)
+        index = cls(config.cache_dir / 'metadata' / f'{key}.pickle',
+                    fingerprint)
+        index.load()
+        return index
+
+    def load(self):
+        try:
+            data = pickle.loads(self.path.read_bytes())
+        except (OSError, pickle.PickleError, EOFError, ValueError,
+                AttributeError, ImportError):
+            data = {}
+
+        if isinstance(data, dict) and data.get('fingerprint') == self.fingerprint:
+            self.entries = data.get('entries', {})
+        else:
+            self.entries = {}
+        self.changed = False
+
+    def save(self):
+        with self._lock:
+            if not self.changed:
+                return
+            self.entries = {
+                key: entry for key, entry in self.entries.items()
+                if Path(key).exists()
+            }
+            data = pickle.dumps(
+                {'fingerprint': self.fingerprint, 'entries': self.entries})
+            self.changed = False
+        try:
+            write_atomic(self.path, data)
+        except OSError as e:
+            print(f'Warning: failed to write metadata index: {e}')
+
+    @staticmethod
+    def get_stamp(path: Path):
+        try:
+            stat = Path(path).stat()
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def get(self, path: Path):
+        """Return (stamp, values); values is None unless the file is unchanged.
+
+        Pass the stamp back to set, so a file edited while it is being
+        parsed is not recorded as up to date.
+        """
+        stamp = self.get_stamp(path)
+        with self._lock:
+            entry = self.entries.get(str(path))
+        values = entry[1] if entry and stamp and entry[0] == stamp else None
+        self.count(values is not None)
+        return stamp, values
+
+    def set(self, path: Path, stamp, values: dict):
+        if stamp is None:
+            return
+        with self._lock:
+            self.entries[str(path)] = (stamp, values)
+            self.changed = True
+
+    def get_entry(self, path: Path):
+        with self._lock:
+            return self.entries.get(str(path))
+
+    def set_entry(self, path: Path, entry):
+        with self._lock:
+            if self.entries.get(str(path)) != entry:
+                self.entries[str(path)] = entry
+                self.changed = True
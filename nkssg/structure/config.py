@@ -171,6 +171,52 @@ class TaxonomyConfigManager(dict[str, TaxonomyConfig]):
             self[k].update(v)
 
 
+@dataclass
+class CacheConfig(BaseConfig):
+
+    enabled: bool = False
+    markdown: bool = True
+    templates: bool = True
+    content_templates: bool = True
+    metadata: bool = True
+
+    def use(self, name):
+        return bool(self.enabled and self.get(name, False))
+
+
+@dataclass
+class ParallelConfig(BaseConfig):
+
+    workers: int = 0  # 0 means os.cpu_count()
+    setup_processes: bool = False
+    render_processes: bool = False
+    output_workers: int = 0  # 0 means writing in the main thread
+
+
+@dataclass
+class OutputConfig(BaseConfig):
+
+    skip_unchanged: bool = False
+    minify_html: bool = False
+    hardlink_static: bool = False  # link static files instead of copying
+
+    gzip: bool = False  # write a .gz next to each output file
+    gzip_level: int = 9
+    gzip_min_size: int = 1024
+    gzip_extensions: list[str] = field(default_factory=lambda: [
+        'html', 'xml', 'css', 'js', 'json', 'txt', 'svg'
+    ])
+
+
+@dataclass
+class SitemapConfig(BaseConfig):
+
+    enabled: bool = False  # replaces the theme's sitemap.xml template
+    max_urls: int = 50000
+    max_bytes: int = 50 * 1024 * 1024
+    gzip: bool = False
+
+
 @dataclass
 class Config(BaseConfig):
 
@@ -193,6 +239,7 @@ class Config(BaseConfig):
     public_dir: Path = Path()
     static_dir: Path = Path()
     themes_dir: Path = Path()
+    cache_dir: Path = Path()
 
     doc_ext: list[str] = field(default_factory=lambda: [
         'md', 'markdown', 'html', 'htm', 'txt'
@@ -215,12 +262,21 @@ class Config(BaseConfig):
 
     use_abs_url: bool = True
 
+    cache: CacheConfig = field(default_factory=CacheConfig)
+
+    output: OutputConfig = field(default_factory=OutputConfig)
+
+    parallel: ParallelConfig = field(default_factory=ParallelConfig)
+
+    sitemap: SitemapConfig = field(default_factory=SitemapConfig)
+
     now = datetime.datetime.now()
 
     env: jinja2.Environment = jinja2.Environment()
 
     def __post_init__(self):
         default_dirs = {dir_type: dir_type for dir_type in self._dir_types}
+        default_dirs['cache'] = '.nkssg_cache'
         if self.base_dir is None:
             self.base_dir = Path.cwd()
         self.set_directory_path(default_dirs)
@@ -267,5 +323,13 @@ class Config(BaseConfig):
                 self.post_type.update(v)
             elif k == 'taxonomy':
                 self.taxonomy.update(v)
+            elif k == 'cache':
+                self.cache.update(v)
+            elif k == 'output':
+                self.output.update(v)
+            elif k == 'parallel':
+                self.parallel.update(v)
+            elif k == 'sitemap':
+                self.sitemap.update(v)
             else:
                 super().update({k: v})
@@ -0,0 +1,297 @@
+from contextlib import contextmanager, nullcontext
+import fnmatch
+import hashlib
+import os
+from pathlib import Path
+import threading
+import weakref
+
+import jinja2
+from jinja2 import nodes
+from jinja2.ext import Extension
+from jinja2.utils import LRUCache
+
+from nkssg.structure.cache import CacheStats
+
+
+class TemplateDependencies:
+    """Reverse index of the templates loaded while rendering each page."""
+
+    def __init__(self):
+        self.pages: dict = {}       # page id -> template names
+        self.templates: dict = {}   # template name -> page ids
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def record(self, page_id, merge=False):
+        names = set()
+        self._local.names = names
+        try:
+            yield names
+        finally:
+            self._local.names = None
+            if merge:
+                self.merge(page_id, names)
+            else:
+                self.set(page_id, names)
+
+    @contextmanager
+    def capture(self):
+        """Collect the names loaded in the block, also adding them to the
+        page being recorded."""
+        outer = getattr(self._local, 'names', None)
+        names = set()
+        self._local.names = names
+        try:
+            yield names
+        finally:
+            self._local.names = outer
+            if outer is not None:
+                outer.update(names)
+
+    def add(self, name):
+        names = getattr(self._local, 'names', None)
+        if names is not None:
+            names.add(name)
+
+    def set(self, page_id, names):
+        with self._lock:
+            for name in self.pages.get(page_id, set()):
+                self.templates[name].discard(page_id)
+            self.pages[page_id] = set(names)
+            for name in names:
+                self.templates.setdefault(name, set()).add(page_id)
+
+    def merge(self, page_id, names):
+        with self._lock:
+            self.pages.setdefault(page_id, set()).update(names)
+            for name in names:
+                self.templates.setdefault(name, set()).add(page_id)
+
+    def get_pages(self, names):
+        with self._lock:
+            return {
+                page_id
+                for name in names
+                for page_id in self.templates.get(name, set())
+            }
+
+
+class TemplateBytecodeCache(CacheStats, jinja2.FileSystemBytecodeCache):
+    """On-disk bytecode cache that counts reused and compiled templates.
+
+    Jinja stores a checksum of the source with the bytecode, so edited
+    templates are compiled again. Entries that are reused get a new mtime,
+    so the ones not used since ``mark`` can be pruned, also when they were
+    used in forked workers.
+    """
+
+    def __init__(self, directory: Path, name='templates'):
+        CacheStats.__init__(self)
+        self.name = name
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        jinja2.FileSystemBytecodeCache.__init__(self, str(directory))
+
+    def get_bucket(self, environment, name, filename, source):
+        bucket = super().get_bucket(environment, name, filename, source)
+        self.count(bucket.code is not None)
+        if bucket.code is not None:
+            try:
+                os.utime(self._get_cache_filename(bucket))
+            except OSError:
+                pass
+        return bucket
+
+    def mark(self):
+        """Return a time to pass to prune, on the clock of the files."""
+        marker = Path(self.directory) / '.mark'
+        marker.touch()
+        return marker.stat().st_mtime
+
+    def prune(self, since):
+        """Remove the entries neither used nor written since the mark."""
+        removed = 0
+        pattern = self.pattern % ('*',)
+        for name in fnmatch.filter(os.listdir(self.directory), pattern):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.stat(path).st_mtime < since:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+
+class FragmentCache(CacheStats):
+    """Rendered {% cache %} blocks, kept for one build."""
+
+    name = 'fragments'
+
+    def __init__(self):
+        super().__init__()
+        self.fragments: dict = {}   # key -> (html, template names)
+        self._key_locks: dict = {}
+
+    def clear(self):
+        with self._lock:
+            self.fragments = {}
+            self._key_locks = {}
+
+    def get_or_render(self, key, render, dependencies=None):
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # one thread renders a key while the others wait for its result
+        with key_lock:
+            fragment = self.fragments.get(key)
+            self.count(fragment is not None)
+            if fragment is None:
+                if dependencies is None:
+                    fragment = (render(), set())
+                else:
+                    with dependencies.capture() as names:
+                        html = render()
+                    fragment = (html, names)
+                self.fragments[key] = fragment
+
+        html, names = fragment
+        if dependencies is not None:
+            for name in names:
+                dependencies.add(name)
+        return html
+
+
+class FragmentCacheExtension(Extension):
+    """``{% cache "name", key... %}...{% endcache %}`` renders the block
+    once per build for each key and reuses the output.
+
+    The block must not depend on anything outside its key, such as mypage.
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=FragmentCache())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method(
+            '_render', [nodes.Const(parser.name), nodes.List(args)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, template_name, key, caller):
+        environment = self.environment
+        key = (template_name, *key)
+        return environment.fragment_cache.get_or_render(
+            key, caller, getattr(environment, 'dependencies', None))
+
+
+class TemplateEnvironment(jinja2.Environment):
+    def __init__(self, dependencies: TemplateDependencies = None,
+                 content_cache: TemplateBytecodeCache = None, **kwargs):
+        super().__init__(**kwargs)
+        self.dependencies = dependencies or TemplateDependencies()
+        self.compile_count = 0
+        self._compile_lock = threading.Lock()
+        self._load_locks: dict = {}
+
+        self.content_cache = content_cache
+        self.content_templates = LRUCache(1000)
+
+    def compile(self, source, name=None, filename=None, raw=False,
+                defer_init=False):
+        with self._compile_lock:
+            self.compile_count += 1
+        return super().compile(source, name, filename, raw, defer_init)
+
+    def _get_load_lock(self, key):
+        with self._compile_lock:
+            return self._load_locks.setdefault(key, threading.Lock())
+
+    def _load_template(self, name, globals):
+        # every get_template, select_template, include, import and extends
+        # goes through here, including cache hits
+        cache_key = (weakref.ref(self.loader), name) if self.loader else None
+        if self.cache is not None and cache_key not in self.cache:
+            # a name is compiled once; other threads wait for it
+            with self._get_load_lock(name):
+                template = super()._load_template(name, globals)
+        else:
+            template = super()._load_template(name, globals)
+        self.dependencies.add(template.name or name)
+        return template
+
+    def from_cached_string(self, source: str):
+        """Like from_string, but reuse the compiled template for the same
+        source, in memory and through the content bytecode cache."""
+        digest = hashlib.sha256(source.encode('UTF-8')).hexdigest()
+        template = self.content_templates.get(digest)
+        if template is not None:
+            return template
+
+        with self._get_load_lock(digest):
+            template = self.content_templates.get(digest)
+            if template is None:
+                template = self._compile_content(source, digest)
+                self.content_templates[digest] = template
+        return template
+
+    def _compile_content(self, source: str, digest: str):
+        bcc = self.content_cache
+        if bcc is None:
+            code = self.compile(source)
+        else:
+            bucket = bcc.get_bucket(self, f'<content:{digest}>', None, source)
+            code = bucket.code
+            if code is None:
+                code = self.compile(source)
+                bucket.code = code
+                bcc.set_bucket(bucket)
+
+        return self.template_class.from_code(
+            self, code, self.make_globals(None), None)
+
+    def find_templates_using(self, variables):
+        """Return the recorded templates that read any of the variables.
+
+        The names are looked up in the parsed template rather than with
+        meta.find_undeclared_variables, which leaves out env globals such
+        as singles and archives.
+        """
+        variables = set(variables)
+        names = set()
+        for name in list(self.dependencies.templates):
+            try:
+                source, _, _ = self.loader.get_source(self, name)
+                ast = self.parse(source)
+                found = {
+                    node.name for node in ast.find_all(nodes.Name)
+                    if node.ctx == 'load'
+                }
+            except jinja2.TemplateError:
+                found = variables
+            if found & variables:
+                names.add(name)
+        return names
+
+
+def from_content_string(env: jinja2.Environment, source: str):
+    if isinstance(env, TemplateEnvironment):
+        return env.from_cached_string(source)
+    return env.from_string(source)
+
+
+def record_dependencies(env: jinja2.Environment, page_id, merge=False):
+    dependencies = getattr(env, 'dependencies', None)
+    if dependencies is None:
+        return nullcontext()
+    return dependencies.record(page_id, merge)
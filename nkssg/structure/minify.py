@@ -0,0 +1,35 @@
+import re
+
+
+# elements and comments kept as they are (<!--# server side includes and
+# <!--! licenses), and the other comments but conditional ones, to drop
+RAW = re.compile(r'''
+    <(?:
+        (pre|textarea|script|style)(?=[\s/>]).*?</\1\s*>
+        | !--(?:([#!]).*?-->|(?!\[if|\s*\[endif).*?-->)
+    )
+''', re.I | re.S | re.X)
+INDENT = re.compile(r'\n\s+')
+
+
+def minify_html(html: str) -> str:
+    """Drop indentation, blank lines and comments from the html.
+
+    The html is walked once: pre, textarea, script and style elements and
+    comments starting with ``#`` or ``!`` are copied untouched, other
+    comments are dropped and the text between them loses its indentation. Runs of whitespace within a line are kept;
+    they are rare in rendered templates and not worth a second scan.
+    """
+    parts = []
+    text = []
+    pos = 0
+    for match in RAW.finditer(html):
+        text.append(html[pos:match.start()])
+        if match.group(1) or match.group(2):
+            parts.append(INDENT.sub('\n', ''.join(text)))
+            parts.append(match.group(0))
+            text = []
+        pos = match.end()
+    text.append(html[pos:])
+    parts.append(INDENT.sub('\n', ''.join(text)))
+    return ''.join(parts)
@@ -25,6 +25,16 @@ class Pages:
 
 
 class Page:
+    # Attributes that plugins add (to_links, imgs, ...) go to the instance
+    # __dict__, which is only allocated once one of them is set.
+    __slots__ = (
+        'id', 'file_id', 'meta', 'title', 'name', 'slug', 'content',
+        'summary', 'image', 'status', 'is_draft', 'is_expired', 'is_future',
+        'html', 'url', 'abs_url', 'rel_url', 'dest_path', 'dest_dir',
+        'aliases', 'page_type', 'archive_list', 'shouldUpdateHtml',
+        'shouldOutput', 'page_number', '__dict__', '__weakref__',
+    )
+
     def __init__(self):
         self.id: PurePath = PurePath('')
         self.file_id = ''
@@ -56,6 +66,22 @@ class Page:
         self.shouldUpdateHtml = True
         self.shouldOutput = True
 
+    def __getstate__(self):
+        state = dict(getattr(self, '__dict__', {}))
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name in ('__dict__', '__weakref__'):
+                    continue
+                try:
+                    state[name] = cls.__dict__[name].__get__(self, cls)
+                except AttributeError:
+                    pass
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
     @property
     def archive_type(self):
         return self.id.parts[1] if len(self.id.parts) >= 2 else ''
@@ -84,11 +110,7 @@ class Page:
             return
 
         output_path = config.public_dir / self.dest_path
-        output_dir = output_path.parent
-        output_dir.mkdir(parents=True, exist_ok=True)
-
-        with open(output_path, 'w', encoding='UTF-8') as f:
-            f.write(self.html)
+        Page.write_file(config, output_path, self.html)
 
         if self.image:
             old_path: Path = self.image.get('old_path')
@@ -96,11 +118,36 @@ class Page:
 
             if old_path and new_path:
                 new_path.parent.mkdir(parents=True, exist_ok=True)
+                if config.get('replace_outputs'):
+                    new_path.unlink(missing_ok=True)
                 shutil.copyfile(str(old_path), str(new_path))
 
         if self.meta.get('aliases'):
             self.output_aliases(config)
 
+    @staticmethod
+    def write_file(config: Config, output_path: Path, text):
+        writer = config.get('output_writer')
+        manifest = config.get('output_manifest')
+        if manifest and not manifest.is_changed(output_path, text):
+            if writer and writer.gzip_writer:
+                writer.gzip_writer.write_missing(output_path)
+            return False
+
+        if writer:
+            writer.write(output_path, text)
+            return True
+
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        if config.get('replace_outputs'):
+            output_path.unlink(missing_ok=True)
+        if isinstance(text, bytes):
+            output_path.write_bytes(text)
+            return True
+        with open(output_path, 'w', encoding='UTF-8') as f:
+            f.write(text)
+        return True
+
     def _get_url_from_dest(self, dest_path=''):
 
         dest_path = dest_path or self.dest_path
@@ -144,11 +191,9 @@ class Page:
 
             output_path = self._get_dest_from_url(url)
             output_path = config.public_dir / output_path
-            output_path.parent.mkdir(parents=True, exist_ok=True)
             print(output_path)
 
-            with open(output_path, 'w', encoding='UTF-8') as f:
-                content = f'''
+            content = f'''
 <!DOCTYPE html>
 <html>
 <head>
@@ -164,4 +209,4 @@ Click <a href="{self.url}">here</a> to go to the new page.
 </body>
 </html>
 '''
-                f.write(content)
+            Page.write_file(config, output_path, content)
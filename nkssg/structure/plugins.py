@@ -1,3 +1,4 @@
+import copy
 from importlib.metadata import entry_points
 
 from nkssg.structure.config import Config
@@ -32,7 +33,27 @@ class Plugins():
 
         return target
 
+    def get_process_safe(self, action_name):
+        """Return the plugins implementing the action for use in a worker
+        process, or None if any of them is not process safe."""
+        plugins = {
+            name: plugin for name, plugin in self.plugins.items()
+            if callable(getattr(plugin, action_name, None))
+        }
+        if not all(getattr(plugin, 'process_safe', False)
+                   for plugin in plugins.values()):
+            return None
+
+        subset = copy.copy(self)
+        subset.plugins = plugins
+        subset.installed_plugins = {}
+        return subset
+
 
 class BasePlugin():
+
+    # set to True if the plugin can run in a worker process
+    process_safe = False
+
     def __init__(self):
         self.config = {}
@@ -0,0 +1,103 @@
+import threading
+
+from nkssg.structure.archives import Archives, Archive
+from nkssg.structure.singles import Singles, Single
+
+
+class Queries:
+    """Read-only lookups over singles and archives for templates.
+
+    Each index is built once, on first use, and returned as a tuple, so a
+    sidebar rendered on every page does not scan the whole site.
+    """
+
+    def __init__(self, singles: Singles, archives: Archives):
+        self._singles = singles
+        self._archives = archives
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key, build):
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        # built outside the lock, as builders use other indexes; threads
+        # racing on a cold key may build it twice but share the first result
+        value = build()
+        with self._lock:
+            return self._cache.setdefault(key, value)
+
+    def pages(self, post_type) -> tuple[Single, ...]:
+        """Singles of the post type, in site order."""
+        return self._get(('pages', post_type), lambda: tuple(
+            single for single in self._singles if single.post_type == post_type
+        ))
+
+    def recent(self, post_type, limit=10) -> tuple[Single, ...]:
+        """The first singles of the post type's root archive."""
+        root = self.root(post_type)
+        if root is None:
+            return ()
+        singles = self._get(('recent', post_type), lambda: tuple(root.singles_all))
+        return singles[:limit]
+
+    def root(self, post_type) -> Archive:
+        """The root archive of the post type, or None."""
+        def build():
+            for archive in self._archives:
+                if archive.archive_type != 'taxonomy' and archive.is_root \
+                        and archive.root_name == post_type:
+                    return archive
+            return None
+        return self._get(('root', post_type), build)
+
+    def terms(self, taxonomy, limit=None, sort='count') -> tuple[Archive, ...]:
+        """Term archives of the taxonomy that have singles.
+
+        Sorted by the number of singles (largest first, ties in archive
+        order) or, with sort=None, in archive order.
+        """
+        def build():
+            terms = [
+                archive for archive in self._archives
+                if archive.archive_type == 'taxonomy'
+                and archive.root_name == taxonomy
+                and not archive.is_root and archive.singles_all_count > 0
+            ]
+            if sort == 'count':
+                terms.sort(key=lambda archive: archive.singles_all_count,
+                           reverse=True)
+            return tuple(terms)
+
+        terms = self._get(('terms', taxonomy, sort), build)
+        return terms if limit is None else terms[:limit]
+
+    def term(self, taxonomy, name) -> Archive:
+        """The term archive by term name, or None."""
+        def build():
+            return {archive.name: archive for archive in self.terms(taxonomy)}
+        return self._get(('term', taxonomy), build).get(name)
+
+    def term_pages(self, taxonomy, name, limit=None) -> tuple[Single, ...]:
+        archive = self.term(taxonomy, name)
+        if archive is None:
+            return ()
+        singles = self._get(
+            ('term_pages', taxonomy, name), lambda: tuple(archive.singles_all))
+        return singles if limit is None else singles[:limit]
+
+    def term_count(self, taxonomy, name) -> int:
+        archive = self.term(taxonomy, name)
+        return archive.singles_all_count if archive else 0
+
+    def years(self, post_type) -> tuple[Archive, ...]:
+        """Year archives of a date post type; months are their children."""
+        def build():
+            return tuple(
+                archive for archive in self._archives
+                if archive.archive_type == 'date'
+                and archive.root_name == post_type
+                and len(archive.id.parts) == 4
+            )
+        return self._get(('years', post_type), build)
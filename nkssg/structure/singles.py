@@ -1,17 +1,45 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import (
+    ProcessPoolExecutor, ThreadPoolExecutor, as_completed)
+import copy
 import datetime
 from fnmatch import fnmatch
 import markdown
 from pathlib import Path, PurePath
 import re
+import sys
+import threading
 from urllib.parse import quote
 
 from ruamel.yaml import YAML, YAMLError
 
+from nkssg.structure.cache import FileCache, MetadataIndex
 from nkssg.structure.config import Config
+from nkssg.structure.environment import (
+    from_content_string, record_dependencies)
+from nkssg.structure.minify import minify_html
 from nkssg.structure.plugins import Plugins
 from nkssg.structure.pages import Pages, Page
 from nkssg.structure.themes import Themes
+from nkssg.structure.workers import (
+    can_fork, get_counters, get_worker_count, map_in_forks)
+
+
+FRONT_MATTER_START = re.compile(r'\s*^---[ \t]*(?:\r?\n|$)', re.MULTILINE)
+FRONT_MATTER_END = re.compile(r'^---[ \t]*$', re.MULTILINE)
+
+# YAML instances are not thread-safe, so each worker thread keeps its own
+_yaml_local = threading.local()
+
+# fields of a single that depend only on its file and the post type config
+METADATA_ATTRS = (
+    'meta', 'date', 'modified', 'title', 'name', 'slug', 'file_id')
+
+
+def _get_yaml():
+    yaml = getattr(_yaml_local, 'yaml', None)
+    if yaml is None:
+        yaml = _yaml_local.yaml = YAML(typ='safe')
+    return yaml
 
 
 class Singles(Pages):
@@ -59,6 +87,10 @@ class Singles(Pages):
             return
 
         self._setup_normal_mode()
+        self._setup_order()
+        self._save_metadata_index()
+
+    def _setup_order(self):
         self.plugins.do_action('after_setup_singles', target=self)
 
         self.pages.sort()
@@ -68,19 +100,101 @@ class Singles(Pages):
         self._setup_file_ids()
         self._setup_src_paths()
 
+    def update_docs(self, updated, removed):
+        """Re-setup only the updated files and drop the removed ones.
+
+        Files that were not singles before go through the
+        after_initialize_singles plugins first. Returns the newly created
+        singles.
+        """
+        known = {page.abs_src_path for page in self.pages}
+        unknown = set(updated) - known
+        selected = self._get_initial_paths() if unknown else set()
+
+        removed = set(updated) | set(removed)
+        pages = [page for page in self.pages if page.abs_src_path not in removed]
+
+        new_pages = []
+        for f in sorted(updated):
+            if not f.exists() or not self._is_valid_file(f):
+                continue
+            if f in unknown and f not in selected:
+                continue
+            new_page = Single(f, self.config).setup(self.config, self.plugins)
+            if self.config.get('serve_all') or not new_page.is_draft:
+                new_pages.append(new_page)
+
+        self.pages = pages + new_pages
+        self._setup_order()
+        self._save_metadata_index()
+        return new_pages
+
+    def _get_initial_paths(self):
+        """Return the source paths a fresh Singles would start from,
+        after the after_initialize_singles plugins have filtered them."""
+        pages = self.pages
+        self.pages = self.get_pages_from_docs_directory()
+        try:
+            target = self.plugins.do_action(
+                'after_initialize_singles', target=self)
+            return {page.abs_src_path for page in target.pages}
+        finally:
+            self.pages = pages
+
+    def _save_metadata_index(self):
+        index: MetadataIndex = self.config.get('caches', {}).get('metadata')
+        if index is not None:
+            index.save()
+
     def _setup_draft_mode(self):
         page = self.pages[0]
         new_page = page.setup(self.config, self.plugins)
         self.pages = [new_page]
 
     def _setup_normal_mode(self):
+        if self.config.parallel.setup_processes and len(self.pages) > 1:
+            pages = self._setup_pages_in_processes()
+        else:
+            # only the front matter is read here, so the work is mostly I/O
+            with ThreadPoolExecutor() as executor:
+                pages = list(executor.map(
+                    lambda page: page.setup(self.config, self.plugins),
+                    self.pages))
+
         new_pages = []
-        for page in self.pages:
-            new_page = page.setup(self.config, self.plugins)
+        for new_page in pages:
             if self.config.get('serve_all') or not new_page.is_draft:
                 new_pages.append(new_page)
         self.pages = new_pages
 
+    def _setup_pages_in_processes(self):
+        config = self.config
+        plugins = self.plugins.get_process_safe('on_get_content')
+        caches = config.get('caches', {})
+
+        workers = get_worker_count(config)
+        chunksize = max(1, len(self.pages) // (workers * 4))
+
+        pages = []
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_setup_worker,
+                initargs=(config, plugins, config.now)) as executor:
+            results = executor.map(
+                _setup_single, self.pages, chunksize=chunksize)
+
+            for page, document, cache_stats, entry in results:
+                if document is not None:
+                    # on_get_content plugins that are not process safe
+                    page = page.setup(config, self.plugins, document)
+                for name, (hits, misses) in cache_stats.items():
+                    caches[name].hits += hits
+                    caches[name].misses += misses
+                if entry is not None:
+                    caches['metadata'].set_entry(page.abs_src_path, entry)
+                pages.append(page)
+        return pages
+
     def _setup_prev_next_page(self):
         bookended = [None] + self.pages + [None]
         zipped = zip(bookended[:-2], bookended[1:-1], bookended[2:])
@@ -88,6 +202,7 @@ class Singles(Pages):
             page1.prev_page, page1.next_page = page0, page2
 
     def _setup_file_ids(self):
+        self.file_ids = {}
         for page in self.pages:
             page_id = str(page.file_id)
             if page_id in self.file_ids:
@@ -110,13 +225,23 @@ class Singles(Pages):
 
         self.setup_dest_path()
 
-    def update_htmls(self, archives, themes: Themes):
-        self.plugins.do_action('before_update_singles_html', target=self)
+    def update_htmls(self, archives, themes: Themes, pages=None):
+        target = self if pages is None else self.subset(pages)
+        self.plugins.do_action('before_update_singles_html', target=target)
+
+        use_processes = self.config.parallel.render_processes
+        if use_processes and can_fork() and len(target.pages) > 1:
+            self._update_htmls_in_processes(target.pages, archives, themes)
+        else:
+            self._update_htmls_in_threads(target.pages, archives, themes)
+
+        self.plugins.do_action('after_update_singles_html', target=target)
 
+    def _update_htmls_in_threads(self, pages, archives, themes: Themes):
         with ThreadPoolExecutor() as executor:
             futures = [
                 executor.submit(page.update_html, self, archives, themes)
-                for page in self.pages
+                for page in pages
             ]
             for future in as_completed(futures):
                 try:
@@ -124,9 +249,38 @@ class Singles(Pages):
                 except Exception as e:
                     print(e)
 
-        self.plugins.do_action('after_update_singles_html', target=self)
+    def _update_htmls_in_processes(self, pages, archives, themes: Themes):
+        dependencies = getattr(self.config.env, 'dependencies', None)
+
+        def render(page: Single):
+            try:
+                page.update_html(self, archives, themes)
+            except Exception as e:
+                print(e)
+                return None
+
+            names = dependencies.pages.get(page.id) if dependencies else None
+            return (page.html, page.content, page.summary,
+                    page.raw_content, names)
+
+        workers = get_worker_count(self.config)
+        results = map_in_forks(
+            render, pages, workers, get_counters(self.config))
+
+        for page, result in zip(pages, results):
+            if result is None:
+                continue
+            page.html, page.content, page.summary, page.raw_content, names = result
+            if names is not None:
+                dependencies.set(page.id, names)
+
+    def subset(self, pages):
+        singles = copy.copy(self)
+        singles.pages = list(pages)
+        return singles
 
     def setup_dest_path(self):
+        self.dest_paths = {}
         for page in self.pages:
             dest_path = str(page.dest_path)
             if dest_path in self.dest_paths:
@@ -144,7 +298,44 @@ class Singles(Pages):
         return single
 
 
+_setup_worker = {}
+
+
+def _init_setup_worker(config: Config, plugins: Plugins, now):
+    config.now = now
+    _setup_worker['config'] = config
+    _setup_worker['plugins'] = plugins
+
+
+def _setup_single(single: 'Single'):
+    config: Config = _setup_worker['config']
+    plugins: Plugins = _setup_worker['plugins']
+    caches = config.get('caches', {})
+    for cache in caches.values():
+        cache.hits = cache.misses = 0
+
+    if plugins is None:
+        document = Single.parse_front_matter(single.abs_src_path)
+    else:
+        single = single.setup(config, plugins)
+        single.load_content()
+        document = None
+
+    cache_stats = {
+        name: (cache.hits, cache.misses) for name, cache in caches.items()
+    }
+    index: MetadataIndex = caches.get('metadata')
+    entry = index.get_entry(single.abs_src_path) if index else None
+    return single, document, cache_stats, entry
+
+
 class Single(Page):
+    __slots__ = (
+        '_abs_src_path', 'src_path', 'post_type', 'src_dir', 'filename',
+        'ext', 'date', 'modified', 'raw_content', '_content', '_loader',
+        '_content_lock', 'content_updated', 'post_type_index',
+        '_archive_type', 'prev_page', 'next_page',
+    )
 
     docs_dir = ''
 
@@ -162,6 +353,11 @@ class Single(Page):
         self.date = self._get_created_date()
         self.modified = self._get_modified_date()
 
+        self.raw_content = None
+        self._loader = None
+        # render threads may ask for the same body at once
+        self._content_lock = threading.Lock()
+
         self.post_type_index = list(config.post_type).index(self.post_type)
         self._archive_type = config.post_type[self.post_type].archive_type
 
@@ -181,7 +377,7 @@ class Single(Page):
         self.src_path = abs_src_path.relative_to(Single.docs_dir)
 
         self.id = PurePath('/docs', self.src_path)
-        self.post_type = self.id.parts[2]
+        self.post_type = sys.intern(self.id.parts[2])
         self.src_dir = self.src_path.parent
         self.filename = self.src_path.stem
         self.ext = self.src_path.suffix[1:]
@@ -190,6 +386,27 @@ class Single(Page):
     def archive_type(self):
         return self._archive_type
 
+    @property
+    def content(self):
+        if self._content is None:
+            self.load_content()
+        return self._content
+
+    @content.setter
+    def content(self, content):
+        self._content = content
+
+    def __getstate__(self):
+        # config and plugins are not sent with each single to other processes
+        state = super().__getstate__()
+        state['_loader'] = None
+        state.pop('_content_lock', None)
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._content_lock = threading.Lock()
+
     def __str__(self):
         return f"Single(src='{self.id}')"
 
@@ -216,16 +433,48 @@ class Single(Page):
 
         return (s_order, self.src_path) < (o_order, other.src_path)
 
-    def setup(self, config: Config, plugins: Plugins):
-
-        self.meta, doc = self.parse_front_matter(self.abs_src_path)
+    def setup(self, config: Config, plugins: Plugins, document=None):
+        """Set up the page from its front matter.
+
+        Without a document only the front matter is read; the body is
+        loaded and converted on the first access to content. Plugins that
+        read content before rendering, such as awesome-page-link, load
+        every body at that point.
+        """
+        index: MetadataIndex = config.get('caches', {}).get('metadata')
+        stamp, values = None, None
+        if document is None and index is not None:
+            stamp, values = index.get(self.abs_src_path)
+
+        if values is not None:
+            self.set_metadata(values)
+        else:
+            if document is None:
+                self.meta = self.read_front_matter(self.abs_src_path)
+            else:
+                self.meta, doc = document
+            self._setup_metadata(config)
+            if index is not None and document is None:
+                index.set(self.abs_src_path, stamp, self.get_metadata())
 
-        self.date, self.modified = self._get_date()
         self.status = self._get_status()
         self.is_expired = self._is_expired(config.now)
         self.is_future = self._is_future(config.now)
         self.is_draft = self._is_draft()
 
+        if document is None:
+            self._content = None
+            self._loader = (config, plugins)
+        else:
+            self.content = self._get_content(doc, config, plugins)
+        self.raw_content = None
+        self.image = self._get_image(config)
+
+        return self
+
+    def _setup_metadata(self, config: Config):
+        self.date, self.modified = self._get_date()
+
         self.title = self._get_title()
         self.name = self._get_name()
 
@@ -233,12 +482,29 @@ class Single(Page):
         post_type_slug = post_type_slug or self.post_type
         self.slug = self._get_slug(post_type_slug)
 
-        self.content = self._get_content(doc, config, plugins)
-        self.image = self._get_image(config)
-
         self.file_id = self._get_file_id()
 
-        return self
+    def get_metadata(self):
+        return {
+            attr: copy.deepcopy(getattr(self, attr)) for attr in METADATA_ATTRS
+        }
+
+    def set_metadata(self, values: dict):
+        for attr in METADATA_ATTRS:
+            setattr(self, attr, copy.deepcopy(values[attr]))
+
+    def load_content(self):
+        with self._content_lock:
+            if self._content is not None:
+                return
+            if self._loader is None:
+                self._content = ''
+                return
+
+            config, plugins = self._loader
+            _, doc = self.parse_front_matter(self.abs_src_path)
+            self._content = self._get_content(doc, config, plugins)
+            self._loader = None
 
     @property
     def is_root(self):
@@ -249,17 +515,36 @@ class Single(Page):
     def parse_front_matter(path):
         try:
             doc = Single.read_document(path)
-            parts = doc.split('---')
-            if len(parts) < 3 or parts[0].strip() != '':
-                return {}, doc
+            return Single._split_front_matter(doc, path)
 
-            try:
-                front_matter = YAML(typ='safe').load(parts[1]) or {}
-            except YAMLError as e:
-                raise ValueError(f"YAML parsing error in {path}: {str(e)}")
+        except FileNotFoundError:
+            raise FileNotFoundError(f"File not found: {path}")
+        except ValueError:
+            raise
+        except Exception as e:
+            raise Exception(
+                f"front matter parse error in {path}: {str(e)}")
 
-            doc = '---'.join(parts[2:])
-            return front_matter, doc
+    @staticmethod
+    def read_front_matter(path):
+        """Parse the front matter, reading the file only up to its end."""
+        try:
+            lines = []
+            opened = False
+            with open(path, 'rb') as f:
+                for line in f:
+                    line = line.decode('UTF-8').replace('\r\n', '\n')
+                    lines.append(line)
+                    if opened:
+                        if FRONT_MATTER_END.match(line):
+                            break
+                    elif line.strip():
+                        if not FRONT_MATTER_START.match(''.join(lines)):
+                            break
+                        opened = True
+
+            front_matter, _ = Single._split_front_matter(''.join(lines), path)
+            return front_matter
 
         except FileNotFoundError:
             raise FileNotFoundError(f"File not found: {path}")
@@ -269,6 +554,38 @@ class Single(Page):
             raise Exception(
                 f"front matter parse error in {path}: {str(e)}")
 
+    @staticmethod
+    def _load_yaml(text: str, path):
+        try:
+            return _get_yaml().load(text) or {}
+        except YAMLError as e:
+            raise ValueError(f"YAML parsing error in {path}: {str(e)}")
+
+    @staticmethod
+    def _split_front_matter(doc: str, path):
+        block = Single.scan_front_matter(doc)
+        if block is None:
+            return {}, doc
+
+        start, end, body_start = block
+        return Single._load_yaml(doc[start:end], path), doc[body_start:]
+
+    @staticmethod
+    def scan_front_matter(doc: str):
+        """Return (start, end, body_start) of the leading front matter block.
+
+        Only a ``---`` line at the top of the document opens the block and
+        only the next ``---`` line closes it, so horizontal rules in the
+        body are left alone.
+        """
+        opening = FRONT_MATTER_START.match(doc)
+        if opening is None:
+            return None
+        closing = FRONT_MATTER_END.search(doc, opening.end())
+        if closing is None:
+            return None
+        return opening.end(), closing.start(), closing.end()
+
     @staticmethod
     def read_document(path):
         try:
@@ -334,7 +651,8 @@ class Single(Page):
         return epoch_datetime
 
     def _get_status(self):
-        return self.meta.get('status', 'publish')
+        status = self.meta.get('status', 'publish')
+        return sys.intern(status) if isinstance(status, str) else status
 
     def _is_expired(self, now):
         expire = self.meta.get('expire')
@@ -392,15 +710,31 @@ class Single(Page):
             return content
 
         if self.ext in ['md', 'markdown']:
-            md_config: dict = config.markdown
-
-            return markdown.markdown(
-                content,
-                extensions=md_config.keys(),
-                extension_configs=md_config)
+            return self._convert_markdown(content, config)
         else:
             return content
 
+    @staticmethod
+    def _convert_markdown(content, config: Config):
+        md_config: dict = config.markdown
+        md_cache: FileCache = config.get('caches', {}).get('markdown')
+
+        if md_cache:
+            key = FileCache.make_key(
+                content, md_config, markdown.__version__)
+            html = md_cache.get(key)
+            if html is not None:
+                return html
+
+        html = markdown.markdown(
+            content,
+            extensions=md_config.keys(),
+            extension_configs=md_config)
+
+        if md_cache:
+            md_cache.set(key, html)
+        return html
+
     def _get_summary(self):
         summary = self.meta.get('summary', self.content)
         remove_patterns = [
@@ -604,16 +938,27 @@ class Single(Page):
         if not self.shouldUpdateHtml:
             return
 
+        with record_dependencies(singles.config.env, self.id):
+            self._update_html(singles, archives, themes)
+
+    def _update_html(self, singles: Singles, archives, themes: Themes):
+
         config = singles.config
         plugins = singles.plugins
         template_file = self.lookup_template(config, themes)
         template = config.env.get_template(str(template_file))
 
+        # keep the pre-render content so that the page can be re-rendered
+        if self.raw_content is None:
+            self.raw_content = self.content
+        self.content = self.raw_content
+
         if any(x in self.content for x in ['{{', '{#', '{%']):
             additional_statement = self._get_shortcode_import_statement(themes)
 
             self.content = additional_statement + self.content
-            self.content = config.env.from_string(self.content).render({
+            content_template = from_content_string(config.env, self.content)
+            self.content = content_template.render({
                 'mypage': self, 'meta': self.meta})
             
         self.summary = self._get_summary()
@@ -633,6 +978,27 @@ class Single(Page):
         self.html = plugins.do_action(
             'after_render_html', target=self.html, **context)
 
+        if config.output.minify_html:
+            self.html = minify_html(self.html)
+
+    def get_digest(self, with_content=True):
+        return FileCache.make_key(
+            str(self.id), self.title, self.url, self.date, self.modified,
+            self.meta, self.image.get('url', ''),
+            self.content if with_content else '')
+
+    def get_render_key(self, digests: dict):
+        neighbours = [
+            (str(page.id), page.title, page.url) if page else None
+            for page in (getattr(self, 'prev_page', None),
+                         getattr(self, 'next_page', None))
+        ]
+        archives = [
+            (str(archive.id), archive.title, archive.url)
+            for archive in self.archive_list
+        ]
+        return FileCache.make_key(digests[self.id], neighbours, archives)
+
     def _get_shortcode_import_statement(self, themes: Themes):
         import_sc = '{% import "import/short-code.html" as sc %}'
         import_scc = '{% import "import/short-code-child.html" as scc %}'
@@ -1,14 +1,27 @@
-import fnmatch
-from pathlib import Path
-import shutil
+from contextlib import contextmanager
+from pathlib import Path, PurePath
 
 import jinja2
 
 from nkssg.structure.archives import Archives
+from nkssg.structure.cache import FileCache, MetadataIndex, OutputManifest
 from nkssg.structure.config import Config
+from nkssg.structure.pages import Page
+from nkssg.structure.environment import (
+    FragmentCacheExtension, TemplateBytecodeCache, TemplateEnvironment,
+    record_dependencies)
+from nkssg.structure.minify import minify_html
 from nkssg.structure.plugins import Plugins
+from nkssg.structure.queries import Queries
 from nkssg.structure.singles import Singles
+from nkssg.structure.sitemap import write_sitemap
+from nkssg.structure.static import PathMatcher, StaticSync
 from nkssg.structure.themes import Themes
+from nkssg.structure.workers import get_worker_count
+from nkssg.structure.writer import GzipWriter, OutputWriter
+
+
+EXTRA_PAGE_ROOT = PurePath('/extra')
 
 
 class Site:
@@ -27,9 +40,66 @@ class Site:
         self.config = self.plugins.do_action(
             'after_setup_post_types', target=self.config)
 
+        self.setup_caches()
+        self.static_stats = ''
+        self.writer_stats = ''
+
         self.singles = Singles(self.config, self.plugins)
         self.archives = Archives(self.config, self.plugins)
 
+    def setup_caches(self):
+        config: Config = self.config
+        caches = {}
+        if config.cache.use('markdown'):
+            caches['markdown'] = FileCache(config.cache_dir, 'markdown')
+        if config.cache.use('templates'):
+            caches['templates'] = TemplateBytecodeCache(
+                config.cache_dir / 'templates')
+        if config.cache.use('content_templates'):
+            caches['content_templates'] = TemplateBytecodeCache(
+                config.cache_dir / 'content_templates', 'content templates')
+        if config.cache.use('metadata'):
+            caches['metadata'] = MetadataIndex.from_config(config)
+        config['caches'] = caches
+
+        if config.output.skip_unchanged:
+            config['output_manifest'] = OutputManifest.from_config(config)
+        else:
+            config['output_manifest'] = None
+
+        if config.output.gzip:
+            config['gzip_manifest'] = OutputManifest.from_config(config, 'gzip')
+        else:
+            config['gzip_manifest'] = None
+
+    def print_build_stats(self):
+        for cache in self.config.get('caches', {}).values():
+            print(cache.stats())
+
+        fragment_cache = getattr(self.config.env, 'fragment_cache', None)
+        if fragment_cache is not None:
+            print(fragment_cache.stats())
+
+        compile_count = getattr(self.config.env, 'compile_count', None)
+        if compile_count is not None:
+            print(f'templates compiled: {compile_count}')
+
+        manifest = self.config.get('output_manifest')
+        if manifest:
+            print(manifest.stats())
+
+        if self.static_stats:
+            print(self.static_stats)
+
+        if self.writer_stats:
+            print(self.writer_stats)
+
+    def save_output_manifest(self):
+        for name in ['output_manifest', 'gzip_manifest']:
+            manifest = self.config.get(name)
+            if manifest:
+                manifest.save()
+
     def setup_post_types(self):
         config: Config = self.config
         config = self.add_missing_post_types(config)
@@ -64,8 +134,11 @@ class Site:
         self.singles.setup()
 
     def update(self):
-        self.config.env = jinja2.Environment(
-            loader=jinja2.FileSystemLoader(self.themes.dirs)
+        self.config.env = TemplateEnvironment(
+            loader=jinja2.FileSystemLoader(self.themes.dirs),
+            bytecode_cache=self.config.get('caches', {}).get('templates'),
+            content_cache=self.config.get('caches', {}).get('content_templates'),
+            extensions=[FragmentCacheExtension]
         )
         self.config.env.globals.update({
             'config': self.config,
@@ -82,68 +155,343 @@ class Site:
             self.archives.update_urls()
             self.plugins.do_action('after_update_urls', target=self)
 
+        self.config.env.globals['query'] = Queries(self.singles, self.archives)
+        # a full render uses every content template still in the site
+        content_cache = self.config.env.content_cache
+        if content_cache is not None and self.config['mode'] != 'draft':
+            since = content_cache.mark()
+        else:
+            content_cache = None
         self.singles.update_htmls(self.archives, self.themes)
         self.archives.update_htmls(self.singles, self.themes)
+        if content_cache is not None:
+            content_cache.prune(since)
         self.plugins.do_action('after_update_site', target=self)
 
-    def output(self):
-        self.copy_static_files()
-        self.singles.output()
-        self.plugins.do_action('after_output_singles', target=self)
+    def update_paths(self, changed, added=(), deleted=()):
+        """Apply changed, added and deleted paths to the built site.
+
+        Returns False when a full rebuild is needed instead.
+        """
+        docs_dir = self.config.docs_dir
+        doc_paths = [
+            {Path(p) for p in paths if docs_dir in Path(p).parents}
+            for paths in (changed, added, deleted)
+        ]
+        other_paths = [
+            {Path(p) for p in paths} - docs
+            for paths, docs in zip((changed, added, deleted), doc_paths)
+        ]
+
+        if any(doc_paths) and not self.update_docs(*doc_paths):
+            return False
+        if any(other_paths) and not self.update_templates(*other_paths):
+            return False
+        return True
+
+    def update_docs(self, changed, added=(), deleted=()):
+        """Re-setup, re-render and output only what the doc changes affect.
+
+        Returns False when the change cannot be handled incrementally,
+        in which case the caller should rebuild the whole site.
+        """
+        config = self.config
+        if config['mode'] == 'draft':
+            return False
+
+        dependencies = getattr(config.env, 'dependencies', None)
+        if dependencies is None:
+            return False
+
+        changed, added, deleted = map(set, (changed, added, deleted))
+        for path in changed | added | deleted:
+            if config.docs_dir not in path.parents:
+                return False
+            rel_path = path.relative_to(config.docs_dir)
+            if len(rel_path.parts) < 2 or rel_path.parts[0] not in config.post_type:
+                return False
 
-        if self.config['mode'] != 'draft':
-            self.archives.output()
+        self.clear_fragment_cache()
+        # back to the content as first set up, so after_update_urls plugins
+        # resolve it again and both keys are taken before rendering
+        rendered = {}
+        for single in self.singles:
+            if single.raw_content is not None:
+                rendered[single.id] = single.content
+                single.content, single.raw_content = single.raw_content, None
+        old_keys = self.get_render_keys()
+        old_site_key = self.get_site_key()
+        old_dest_paths = self.get_dest_paths()
+        old_archive_pages = self.archives.archive_pages
+        old_page_keys = self.archives.page_keys
+
+        new_singles = self.singles.update_docs(changed | added, deleted)
+        for single in self.singles:
+            single.archive_list = []
+
+        self.archives = Archives(config, self.plugins)
+        config.env.globals['archives'] = self.archives
+        self.archives.setup(self.singles)
+        self.singles.update_urls()
+        self.archives.update_urls()
+        self.plugins.do_action('after_update_urls', target=self)
+
+        self.archives.archive_pages = {
+            id: pages for id, pages in old_archive_pages.items()
+            if id in self.archives.archives
+        }
+        config.env.globals['query'] = Queries(self.singles, self.archives)
+
+        new_keys = self.get_render_keys()
+        if self.get_site_key() != old_site_key:
+            names = config.env.find_templates_using(
+                ['singles', 'archives', 'query'])
+            global_ids = dependencies.get_pages(names)
+        else:
+            global_ids = set()
+
+        def should_update(page):
+            return (page.id in global_ids
+                    or old_keys.get(page.id) != new_keys[page.id])
+
+        new_ids = {page.id for page in new_singles}
+        singles = [
+            page for page in self.singles
+            if page.id in new_ids or should_update(page)
+            or any(x in page.content for x in ['{{', '{#', '{%'])
+        ]
+        update_ids = {page.id for page in singles}
+        for page in self.singles:
+            if page.id in rendered and page.id not in update_ids:
+                page.raw_content = page.content
+                page.content = rendered[page.id]
+        archives = [page for page in self.archives if should_update(page)]
+        extra_pages = [
+            id.relative_to(EXTRA_PAGE_ROOT).as_posix()
+            for id in global_ids if EXTRA_PAGE_ROOT in id.parents
+        ]
+
+        # archives that read the site globals are rendered in full
+        self.archives.page_keys = {
+            id: keys for id, keys in old_page_keys.items()
+            if id not in global_ids
+        }
+        self.singles.update_htmls(self.archives, self.themes, singles)
+        self.archives.update_htmls(
+            self.singles, self.themes, archives, reuse=True)
+        self.plugins.do_action('after_update_site', target=self)
+
+        with self.output_writer() as writer:
+            for page in singles:
+                page.output(config)
+            writer.flush()
+            self.plugins.do_action('after_output_singles', target=self)
+
+            rendered_pages = self.archives.rendered_pages
+            for archive in archives:
+                for page in self.archives.archive_pages.get(archive.id, []):
+                    if page in rendered_pages:
+                        page.output(config)
+            writer.flush()
             self.plugins.do_action('after_output_archives', target=self)
-            self.output_extra_pages()
 
-        self.plugins.do_action('after_output_site', target=self)
-        self.plugins.do_action('on_end', target=self)
+            if extra_pages:
+                self.output_extra_pages(extra_pages)
+            if config.sitemap.enabled:
+                self.output_sitemap()
+        self.remove_outputs(old_dest_paths - self.get_dest_paths())
 
-    def copy_static_files(self):
-        def copy_file_if_newer(src: Path, dest: Path):
-            if dest.exists() and src.stat().st_mtime <= dest.stat().st_mtime:
-                return
-            dest.parent.mkdir(parents=True, exist_ok=True)
-            shutil.copyfile(src, dest)
-
-        for f in self.config.static_dir.glob('**/*'):
-            if f.is_file():
-                rel_path = f.relative_to(self.config.static_dir)
-                to_path = self.config.public_dir / rel_path
-                copy_file_if_newer(f, to_path)
-
-        for d in self.themes.dirs:
-            for f in d.glob('**/*'):
-                if f.is_file() and self.is_target(f.relative_to(d.parent)):
-                    rel_path = f.relative_to(d.parent)
-                    to_path = self.config.public_dir / 'themes' / rel_path
-                    copy_file_if_newer(f, to_path)
-
-    def is_target(self, rel_path):
-        for pattern in self.themes.cnf.get('static_exclude', []):
-            if fnmatch.fnmatch(rel_path, pattern):
+        self.save_output_manifest()
+        self.plugins.do_action('after_output_site', target=self)
+        return True
+
+    def get_render_keys(self):
+        digests = {single.id: single.get_digest() for single in self.singles}
+        keys = {
+            single.id: single.get_render_key(digests)
+            for single in self.singles
+        }
+        keys.update({
+            archive.id: archive.get_render_key(digests)
+            for archive in self.archives
+        })
+        return keys
+
+    def get_site_key(self):
+        singles = [
+            (str(single.id), single.get_digest(with_content=False))
+            for single in self.singles
+        ]
+        archives = [
+            (str(archive.id), archive.title, archive.url,
+             archive.singles_all_count)
+            for archive in self.archives
+        ]
+        return FileCache.make_key(singles, archives)
+
+    def get_dest_paths(self):
+        dest_paths = {str(page.dest_path) for page in self.singles}
+        dest_paths.update(str(page.dest_path) for page in self.archives.pages)
+        return dest_paths
+
+    def remove_outputs(self, dest_paths):
+        for dest_path in dest_paths:
+            output_path = self.config.public_dir / dest_path
+            if output_path.is_file():
+                output_path.unlink()
+            output_path.with_name(output_path.name + '.gz').unlink(
+                missing_ok=True)
+
+    def clear_fragment_cache(self):
+        fragment_cache = getattr(self.config.env, 'fragment_cache', None)
+        if fragment_cache is not None:
+            fragment_cache.clear()
+
+    def update_templates(self, changed, added=(), deleted=()):
+        """Re-render and output only the pages that use the changed templates.
+
+        Returns False when the change cannot be handled incrementally
+        (added or deleted files, theme config or files outside the themes),
+        in which case the caller should rebuild the whole site.
+        """
+        if added or deleted:
+            return False
+
+        names = set()
+        for path in changed:
+            name = self.themes.get_template_name(Path(path))
+            if not name or name.endswith('.yml'):
                 return False
+            names.add(name)
+
+        dependencies = getattr(self.config.env, 'dependencies', None)
+        if dependencies is None:
+            return False
+
+        self.clear_fragment_cache()
+        ids = dependencies.get_pages(names)
+        singles = [page for page in self.singles if page.id in ids]
+        archives = [page for page in self.archives if page.id in ids]
+        extra_pages = [
+            id.relative_to(EXTRA_PAGE_ROOT).as_posix()
+            for id in ids if EXTRA_PAGE_ROOT in id.parents
+        ]
+
+        if singles:
+            self.singles.update_htmls(self.archives, self.themes, singles)
+        if archives:
+            self.archives.update_htmls(self.singles, self.themes, archives)
+
+        with self.output_writer():
+            self.copy_static_files()
+            for page in singles:
+                page.output(self.config)
+            for archive in archives:
+                for page in self.archives.archive_pages.get(archive.id, []):
+                    page.output(self.config)
+            if extra_pages:
+                self.output_extra_pages(extra_pages)
+
+        self.save_output_manifest()
+        return True
+
+    @contextmanager
+    def output_writer(self):
+        config = self.config
+        gzip_writer = None
+        if config.output.gzip:
+            gzip_writer = GzipWriter(
+                level=config.output.gzip_level,
+                min_size=config.output.gzip_min_size,
+                extensions=config.output.gzip_extensions,
+                workers=get_worker_count(config),
+                manifest=config.get('gzip_manifest'),
+                replace=config.get('replace_outputs', False),
+            )
+
+        workers = config.parallel.output_workers
+        writer = OutputWriter(workers, gzip_writer=gzip_writer,
+                              replace=config.get('replace_outputs', False))
+        self.config['output_writer'] = writer
+        try:
+            with writer:
+                yield writer
+        finally:
+            self.config['output_writer'] = None
+            self.writer_stats = writer.stats()
 
-        for pattern in self.themes.cnf.get('static_include', []):
-            if fnmatch.fnmatch(rel_path, pattern):
-                return True
-        return False
+    def output(self):
+        with self.output_writer() as writer:
+            self.copy_static_files()
+            self.singles.output()
+            writer.flush()
+            self.plugins.do_action('after_output_singles', target=self)
+
+            if self.config['mode'] != 'draft':
+                self.archives.output()
+                writer.flush()
+                self.plugins.do_action('after_output_archives', target=self)
+                self.output_extra_pages()
+
+        self.save_output_manifest()
+        self.plugins.do_action('after_output_site', target=self)
+        self.plugins.do_action('on_end', target=self)
 
-    def output_extra_pages(self):
+    def copy_static_files(self):
+        config = self.config
+        sync = StaticSync.from_config(config, get_worker_count(config))
+        sync.add_tree(config.static_dir, config.public_dir)
+
+        is_target = self.get_static_matcher()
+        for d in map(Path, self.themes.dirs):
+            sync.add_tree(d, config.public_dir / 'themes' / d.name,
+                          is_target, base_dir=d.parent)
+
+        sync.sync()
+        sync.save()
+        self.static_stats = sync.stats()
+
+        writer = config.get('output_writer')
+        gzip_writer = writer.gzip_writer if writer else None
+        if gzip_writer:
+            for path in sync.copied:
+                gzip_writer.write_file(path)
+            for path in sync.unchanged:
+                gzip_writer.write_missing(path)
+
+    def get_static_matcher(self):
+        return PathMatcher(self.themes.cnf.get('static_include', []),
+                           self.themes.cnf.get('static_exclude', []))
+
+    def output_extra_pages(self, targets=None):
         theme_config = self.themes.cnf
         extra_pages = theme_config.get('extra_pages', [])
         extra_pages = set(extra_pages + self.config.extra_pages)
 
         for extra_page in extra_pages:
+            if targets is not None and extra_page not in targets:
+                continue
+            if extra_page == 'sitemap.xml' and self.config.sitemap.enabled:
+                # update_docs writes it once after the targets
+                if targets is None:
+                    self.output_sitemap()
+                continue
             template_path = self.themes.lookup_template([extra_page])
             if template_path:
                 self.output_extra_page(extra_page, template_path)
             elif extra_page not in self.config.extra_pages:
                 print(f'{extra_page} is not found on extra pages')
 
+    def output_sitemap(self):
+        return write_sitemap(self.config, self.singles)
+
     def output_extra_page(self, extra_page, template_path):
-        template = self.config.env.get_template(template_path)
-        html = template.render()
+        with record_dependencies(
+                self.config.env, EXTRA_PAGE_ROOT / extra_page):
+            template = self.config.env.get_template(template_path)
+            html = template.render()
+        if self.config.output.minify_html and extra_page.endswith('.html'):
+            html = minify_html(html)
 
         if extra_page == 'home.html':
             output_path = 'index.html'
@@ -153,7 +501,4 @@ class Site:
             output_path = template_path
 
         output_path = self.config.public_dir / output_path
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-
-        with open(output_path, 'w', encoding='UTF-8') as f:
-            f.write(html)
+        Page.write_file(self.config, output_path, html)
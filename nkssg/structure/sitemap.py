@@ -0,0 +1,176 @@
+from functools import partial
+import gzip
+import io
+from pathlib import Path
+import re
+from xml.sax.saxutils import escape
+
+from nkssg.structure.pages import Page
+
+
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+URLSET_START = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    f'<urlset xmlns="{SITEMAP_NS}">\n'
+).encode('UTF-8')
+URLSET_END = b'</urlset>\n'
+SHARD_NAME = re.compile(r'sitemap-\d+\.xml(\.gz)?')
+
+
+class SitemapWriter:
+    """Stream <url> entries to ``sitemap-N.xml`` shards.
+
+    A shard is closed before it would exceed ``max_urls`` entries or
+    ``max_bytes`` uncompressed, and then passed to ``write_file`` with
+    its path. ``close`` writes ``sitemap.xml`` as an index of the shards,
+    or writes a lone uncompressed shard as it.
+    """
+
+    def __init__(self, public_dir: Path, site_url='', max_urls=50000,
+                 max_bytes=50 * 1024 * 1024, compress=False, write_file=None):
+        self.public_dir = Path(public_dir)
+        self.site_url = site_url.rstrip('/')
+        self.max_urls = max(1, max_urls)
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.write_file = write_file or write_bytes
+
+        self.shards: list[tuple[str, str]] = []  # (filename, lastmod)
+        self.urls = 0
+        self._file = None
+        self._buffer = None
+        self._first = None  # held until it is known if it is the only one
+        self._count = 0
+        self._bytes = 0
+        self._lastmod = ''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._close_shard()
+
+    def write(self, loc: str, lastmod: str = ''):
+        entry = f'<url>\n<loc>{escape(loc)}</loc>\n'
+        if lastmod:
+            entry += f'<lastmod>{lastmod}</lastmod>\n'
+        data = (entry + '</url>\n').encode('UTF-8')
+
+        if self._file is not None and (
+                self._count >= self.max_urls
+                or self._bytes + len(data) + len(URLSET_END) > self.max_bytes):
+            self._close_shard()
+        if self._file is None:
+            self._open_shard()
+
+        self._file.write(data)
+        self._count += 1
+        self._bytes += len(data)
+        self._lastmod = max(self._lastmod, lastmod)
+        self.urls += 1
+
+    def close(self):
+        """Finish the sitemap and return the names of the files written."""
+        self._close_shard()
+        index_path = self.public_dir / 'sitemap.xml'
+
+        if len(self.shards) == 1 and self._first is not None:
+            self.write_file(index_path, self._first)
+            self._first = None
+            names = ['sitemap.xml']
+        else:
+            if not self.shards:
+                self._open_shard()
+                self._close_shard()
+            self._write_first()
+            self.write_file(index_path, self._get_index())
+            names = ['sitemap.xml'] + [name for name, _ in self.shards]
+
+        self._remove_stale_shards(names)
+        return names
+
+    def _open_shard(self):
+        ext = '.xml.gz' if self.compress else '.xml'
+        name = f'sitemap-{len(self.shards) + 1}{ext}'
+
+        self._buffer = io.BytesIO()
+        if self.compress:
+            # mtime=0 keeps the output the same between builds
+            self._file = gzip.GzipFile(
+                filename='', mode='wb', fileobj=self._buffer, mtime=0)
+        else:
+            self._file = self._buffer
+        self._file.write(URLSET_START)
+
+        self.shards.append((name, ''))
+        self._count = 0
+        self._bytes = len(URLSET_START)
+        self._lastmod = ''
+
+    def _close_shard(self):
+        if self._file is None:
+            return
+        self._file.write(URLSET_END)
+        if self._file is not self._buffer:
+            self._file.close()
+        data = self._buffer.getvalue()
+        self._file = self._buffer = None
+
+        name = self.shards[-1][0]
+        self.shards[-1] = (name, self._lastmod)
+        if len(self.shards) == 1 and not self.compress:
+            self._first = data
+        else:
+            self._write_first()
+            self.write_file(self.public_dir / name, data)
+
+    def _write_first(self):
+        if self._first is not None:
+            self.write_file(self.public_dir / self.shards[0][0], self._first)
+            self._first = None
+
+    def _get_index(self):
+        lines = [
+            '<?xml version="1.0" encoding="UTF-8"?>\n',
+            f'<sitemapindex xmlns="{SITEMAP_NS}">\n',
+        ]
+        for name, lastmod in self.shards:
+            lines.append(f'<sitemap>\n<loc>{escape(self.site_url)}/{name}</loc>\n')
+            if lastmod:
+                lines.append(f'<lastmod>{lastmod}</lastmod>\n')
+            lines.append('</sitemap>\n')
+        lines.append('</sitemapindex>\n')
+        return ''.join(lines).encode('UTF-8')
+
+    def _remove_stale_shards(self, names):
+        for path in self.public_dir.glob('sitemap-*.xml*'):
+            if SHARD_NAME.fullmatch(path.name) and path.name not in names:
+                path.unlink()
+
+
+def write_bytes(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.unlink(missing_ok=True)
+    path.write_bytes(data)
+
+
+def get_lastmod(page):
+    date = getattr(page, 'modified', None) or getattr(page, 'date', None)
+    return date.strftime('%Y-%m-%d') if date else ''
+
+
+def write_sitemap(config, pages):
+    """Write the sitemap of the pages to public_dir through the output
+    writer and manifest; return the file names."""
+    sitemap_config = config.sitemap
+    with SitemapWriter(
+        config.public_dir,
+        config.site.site_url,
+        max_urls=sitemap_config.max_urls,
+        max_bytes=sitemap_config.max_bytes,
+        compress=sitemap_config.gzip,
+        write_file=partial(Page.write_file, config),
+    ) as writer:
+        for page in pages:
+            writer.write(page.abs_url, get_lastmod(page))
+    return writer.close()
@@ -0,0 +1,191 @@
+from concurrent.futures import ThreadPoolExecutor
+import fnmatch
+import json
+import os
+from pathlib import Path
+import re
+import shutil
+
+from nkssg.structure.cache import get_manifest_path, write_atomic
+
+
+def compile_patterns(patterns):
+    """Return one regex matching any of the fnmatch patterns, or None."""
+    if not patterns:
+        return None
+    return re.compile('|'.join(
+        fnmatch.translate(os.path.normcase(pattern)) for pattern in patterns
+    ))
+
+
+class PathMatcher:
+    """static_include and static_exclude, compiled once; exclude wins."""
+
+    def __init__(self, include=(), exclude=()):
+        self.include = compile_patterns(include)
+        self.exclude = compile_patterns(exclude)
+
+    def __call__(self, rel_path) -> bool:
+        if self.include is None:
+            return False
+        rel_path = os.path.normcase(rel_path)
+        if self.exclude is not None and self.exclude.match(rel_path):
+            return False
+        return self.include.match(rel_path) is not None
+
+
+class StaticSync:
+    """Copy static trees to public_dir, skipping files copied before.
+
+    The manifest maps each destination to the source and the size and
+    mtime it was copied from, so an unchanged tree costs one scan of the
+    sources and a listing of each destination directory. Destinations
+    whose sources are gone are deleted.
+    """
+
+    version = 2
+
+    def __init__(self, path: Path, public_dir: Path, workers=1,
+                 hardlink=False):
+        self.path = Path(path) if path else None
+        self.public_dir = Path(public_dir)
+        self.workers = max(1, workers)
+        self.hardlink = hardlink
+
+        # keyed by the dest path relative to public_dir, so the manifest
+        # also fits a staging dir that replaces public_dir
+        self.entries: dict[str, list] = {}  # dest -> [src, size, mtime_ns]
+        self.sources: dict[str, Path] = {}  # dest -> src
+        self.copied: list[Path] = []
+        self.unchanged: list[Path] = []
+        self.deleted: list[Path] = []
+
+    @classmethod
+    def from_config(cls, config, workers=1):
+        sync = cls(get_manifest_path(config, 'static'), config.public_dir,
+                   workers, config.output.hardlink_static)
+        sync.load()
+        return sync
+
+    def load(self):
+        if self.path is None:
+            self.entries = {}
+            return
+        try:
+            data = json.loads(self.path.read_text(encoding='UTF-8'))
+        except (OSError, ValueError):
+            data = {}
+
+        if isinstance(data, dict) and data.get('version') == self.version:
+            self.entries = data.get('entries', {})
+        else:
+            self.entries = {}
+
+    def save(self):
+        if self.path is None:
+            return
+        data = {
+            'version': self.version,
+            'entries': self.entries,
+        }
+        try:
+            write_atomic(self.path, json.dumps(data, sort_keys=True))
+        except OSError as e:
+            print(f'Warning: failed to write static manifest: {e}')
+
+    def add_tree(self, src_dir: Path, dest_dir: Path, is_target=None,
+                 base_dir: Path = None):
+        """Add the files under src_dir; is_target gets the path relative
+        to base_dir (default src_dir) and filters the files."""
+        src_dir = Path(src_dir)
+        base_dir = Path(base_dir or src_dir)
+        prefix = os.path.relpath(src_dir, base_dir)
+
+        for root, _, files in os.walk(src_dir):
+            rel_root = os.path.relpath(root, src_dir)
+            for name in files:
+                rel_path = os.path.normpath(os.path.join(rel_root, name))
+                if is_target is not None and \
+                        not is_target(os.path.normpath(os.path.join(prefix, rel_path))):
+                    continue
+                dest = Path(dest_dir) / rel_path
+                key = os.path.relpath(dest, self.public_dir)
+                self.sources[Path(key).as_posix()] = Path(root) / name
+
+    def sync(self):
+        """Copy the added files that changed and delete removed ones."""
+        dests = {key: self.public_dir / key for key in self.sources}
+        existing = self._list_files({dest.parent for dest in dests.values()})
+
+        tasks = []
+        entries = {}
+        for key, src in self.sources.items():
+            try:
+                stat = src.stat()
+            except OSError:
+                continue
+            entry = [str(src), stat.st_size, stat.st_mtime_ns]
+            entries[key] = entry
+
+            dest = dests[key]
+            if dest not in existing:
+                tasks.append((src, dest))
+            elif self.entries.get(key) == entry or \
+                    (key not in self.entries and self._is_newer(dest, stat)):
+                self.unchanged.append(dest)
+            else:
+                tasks.append((src, dest))
+
+        for key in self.entries.keys() - entries.keys():
+            path = self.public_dir / key
+            path.unlink(missing_ok=True)
+            path.with_name(path.name + '.gz').unlink(missing_ok=True)
+            self.deleted.append(path)
+
+        for parent in {dest.parent for _, dest in tasks}:
+            parent.mkdir(parents=True, exist_ok=True)
+        if self.workers > 1 and len(tasks) > 1:
+            with ThreadPoolExecutor(self.workers) as executor:
+                list(executor.map(lambda task: self._copy(*task), tasks))
+        else:
+            for task in tasks:
+                self._copy(*task)
+
+        self.copied = [dest for _, dest in tasks]
+        self.entries = entries
+        self.sources = {}
+        return self.copied
+
+    def stats(self):
+        return (f'static: {len(self.copied)} copied, '
+                f'{len(self.unchanged)} unchanged, {len(self.deleted)} deleted')
+
+    @staticmethod
+    def _list_files(dirs):
+        files = set()
+        for d in dirs:
+            try:
+                with os.scandir(d) as it:
+                    files.update(d / entry.name for entry in it)
+            except OSError:
+                pass
+        return files
+
+    @staticmethod
+    def _is_newer(dest, src_stat):
+        # files from before the manifest existed: the old mtime rule
+        try:
+            return Path(dest).stat().st_mtime >= src_stat.st_mtime
+        except OSError:
+            return False
+
+    def _copy(self, src: Path, dest: Path):
+        # a new file, so a dest hardlinked elsewhere is not changed
+        dest.unlink(missing_ok=True)
+        if self.hardlink:
+            try:
+                os.link(src, dest)
+                return
+            except OSError:
+                pass
+        shutil.copyfile(src, dest)
@@ -11,6 +11,10 @@ class Themes:
         self.dirs: list[Path] = []
         self.cnf = {}
 
+        self._index_dirs: tuple[Path, ...] = None
+        self._index: dict[str, tuple[Path, Path]] = {}
+        self._lookups: dict[tuple, str] = {}
+
         self.load_theme(config, 'name')
         self.load_theme(config, 'child')
 
@@ -47,14 +51,43 @@ class Themes:
         self.load_theme_config(default_theme_dir, default_theme_name)
 
     def lookup_template(self, search_list: list[str], full_path=False):
+        self._update_index()
+
+        key = (tuple(search_list), full_path)
+        if key not in self._lookups:
+            self._lookups[key] = self._lookup_index(search_list, full_path)
+        return self._lookups[key]
+
+    def _lookup_index(self, search_list: list[str], full_path):
         for search in search_list:
-            for d in self.dirs:
-                for f in d.glob('**/*'):
-                    if f.is_file() and f.name == search:
-                        if full_path:
-                            path = f
-                        else:
-                            path = f.relative_to(d)
-                        path = str(path).replace('\\', '/')
-                        return path
+            if search in self._index:
+                d, f = self._index[search]
+                if full_path:
+                    path = f
+                else:
+                    path = f.relative_to(d)
+                path = str(path).replace('\\', '/')
+                return path
+        return ''
+
+    def _update_index(self):
+        dirs = tuple(self.dirs)
+        if dirs == self._index_dirs:
+            return
+
+        # filename -> (theme dir, file), the first theme dir wins
+        index = {}
+        for d in dirs:
+            for f in d.glob('**/*'):
+                if f.is_file():
+                    index.setdefault(f.name, (d, f))
+
+        self._index = index
+        self._lookups = {}
+        self._index_dirs = dirs
+
+    def get_template_name(self, path: Path):
+        for d in self.dirs:
+            if d in path.parents:
+                return path.relative_to(d).as_posix()
         return ''
@@ -0,0 +1,80 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+
+
+# (func, items) inherited by forked workers; only indices and results are
+# sent between processes, so the items themselves are never pickled.
+_fork_target = None
+
+
+def can_fork():
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def get_worker_count(config):
+    return config.parallel.workers or os.cpu_count() or 1
+
+
+def get_counters(config):
+    """Return the (object, attribute) pairs of the build stats that
+    rendering updates: cache hits and misses and the compile count."""
+    env = config.env
+    stats = list(config.get('caches', {}).values())
+    fragment_cache = getattr(env, 'fragment_cache', None)
+    if fragment_cache is not None:
+        stats.append(fragment_cache)
+
+    counters = [
+        (obj, attr) for obj in stats for attr in ('hits', 'misses')]
+    if hasattr(env, 'compile_count'):
+        counters.append((env, 'compile_count'))
+    return counters
+
+
+def map_in_forks(func, items: list, workers: int, counters=()):
+    """Return [func(item) for item in items], computed in forked processes.
+
+    The workers are forked after this call starts, so they share the
+    current state of the parent copy-on-write. Changes made by func to
+    the items stay in the worker; only the return values come back,
+    along with what func added to the (object, attribute) counters,
+    which is added to them in the parent.
+    """
+    global _fork_target
+
+    items = list(items)
+    counters = list(counters)
+    if not items:
+        return []
+
+    workers = max(1, min(workers, len(items)))
+    size = -(-len(items) // (workers * 4))
+    chunks = [
+        range(start, min(start + size, len(items)))
+        for start in range(0, len(items), size)
+    ]
+
+    _fork_target = (func, items, counters)
+    try:
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(workers, mp_context=context) as executor:
+            results = []
+            for chunk_results, deltas in executor.map(_run_chunk, chunks):
+                results.extend(chunk_results)
+                for (obj, attr), delta in zip(counters, deltas):
+                    setattr(obj, attr, getattr(obj, attr) + delta)
+            return results
+    finally:
+        _fork_target = None
+
+
+def _run_chunk(indices):
+    func, items, counters = _fork_target
+    before = [getattr(obj, attr) for obj, attr in counters]
+    results = [func(items[i]) for i in indices]
+    deltas = [
+        getattr(obj, attr) - start
+        for (obj, attr), start in zip(counters, before)
+    ]
+    return results, deltas
@@ -0,0 +1,223 @@
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import os
+from pathlib import Path
+import queue
+import threading
+
+
+class OutputWriter:
+    """Write output files from a bounded queue with worker threads.
+
+    With ``workers=0`` files are written synchronously by the caller.
+    Each distinct output directory is created only once. With
+    ``replace=True`` existing files are unlinked before writing, so files
+    hardlinked from a previous build are not changed in place.
+    """
+
+    def __init__(self, workers=0, queue_size=0, gzip_writer=None,
+                 replace=False):
+        self.workers = max(0, workers)
+        self.gzip_writer = gzip_writer
+        self.replace = replace
+        self.files = 0
+        self.bytes = 0
+
+        self._dirs: set[Path] = set()
+        self._errors: list[Exception] = []
+        self._lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+        self._queue = None
+        if self.workers:
+            self._queue = queue.Queue(maxsize=queue_size or self.workers * 64)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(raise_errors=exc_type is None)
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def write(self, path: Path, text):
+        """Write text as UTF-8, or bytes as they are."""
+        path = Path(path)
+        parent = path.parent
+        with self._lock:
+            is_new_dir = parent not in self._dirs
+            self._dirs.add(parent)
+        if is_new_dir:
+            parent.mkdir(parents=True, exist_ok=True)
+
+        if self._queue is None:
+            self._write(path, text)
+        else:
+            self._queue.put((path, text))
+
+    def flush(self):
+        if self._queue is not None:
+            self._queue.join()
+        if self.gzip_writer:
+            self.gzip_writer.flush()
+        self._raise_errors()
+
+    def close(self, raise_errors=True):
+        if self._queue is not None:
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+        if self.gzip_writer:
+            self.gzip_writer.close(raise_errors)
+        if raise_errors:
+            self._raise_errors()
+
+    def stats(self):
+        stats = f'output writer: {self.files} files, {self.bytes} bytes'
+        if self.gzip_writer:
+            stats += '\n' + self.gzip_writer.stats()
+        return stats
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as e:
+                with self._lock:
+                    self._errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, path: Path, text):
+        if isinstance(text, bytes):
+            data = text
+        else:
+            if os.linesep != '\n':
+                text = text.replace('\n', os.linesep)
+            data = text.encode('UTF-8')
+        if self.replace:
+            path.unlink(missing_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        with self._lock:
+            self.files += 1
+            self.bytes += len(data)
+
+        if self.gzip_writer:
+            self.gzip_writer.write(path, data)
+
+    def _raise_errors(self):
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise errors[0]
+
+
+class GzipWriter:
+    """Write a ``.gz`` sibling of output files in worker threads.
+
+    Files with other extensions are skipped, and so are files smaller than
+    ``min_size``, whose stale ``.gz`` is removed. With a manifest, files
+    whose content has not changed since the last build are not compressed
+    again.
+    """
+
+    def __init__(self, level=9, min_size=0, extensions=(), workers=1,
+                 manifest=None, replace=False):
+        self.level = level
+        self.replace = replace
+        self.min_size = min_size
+        self.extensions = {ext.lower().lstrip('.') for ext in extensions}
+        self.manifest = manifest
+        self.files = 0
+        self.skipped = 0
+
+        self._executor = ThreadPoolExecutor(max(1, workers))
+        self._futures = []
+        self._errors: list[Exception] = []
+        self._lock = threading.Lock()
+
+    def is_target(self, path: Path):
+        return Path(path).suffix.lower().lstrip('.') in self.extensions
+
+    def write(self, path: Path, data: bytes):
+        if self.is_target(path):
+            self._submit(self._compress, Path(path), data)
+
+    def write_file(self, path: Path):
+        """Compress a file that was written without the output writer."""
+        if self.is_target(path):
+            self._submit(self._compress, Path(path), None)
+
+    def write_missing(self, path: Path):
+        """Compress a file kept from a previous build if it has no .gz."""
+        path = Path(path)
+        if self.is_target(path) and \
+                not path.with_name(path.name + '.gz').exists():
+            self._submit(self._compress, path, None)
+
+    def flush(self):
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+        self._raise_errors()
+
+    def close(self, raise_errors=True):
+        self._executor.shutdown(wait=True)
+        self._futures = []
+        if raise_errors:
+            self._raise_errors()
+
+    def stats(self):
+        return f'gzip: {self.files} files, {self.skipped} unchanged'
+
+    def _submit(self, func, *args):
+        future = self._executor.submit(self._run, func, *args)
+        with self._lock:
+            self._futures.append(future)
+
+    def _run(self, func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            with self._lock:
+                self._errors.append(e)
+
+    def _compress(self, path: Path, data: bytes):
+        if data is None:
+            data = path.read_bytes()
+
+        gz_path = path.with_name(path.name + '.gz')
+        if len(data) < self.min_size:
+            gz_path.unlink(missing_ok=True)
+            return
+        if self.manifest and not self.manifest.is_changed(gz_path, data):
+            with self._lock:
+                self.skipped += 1
+            return
+
+        # mtime=0 keeps the output the same between builds
+        gz_data = gzip.compress(data, compresslevel=self.level, mtime=0)
+        if self.replace:
+            gz_path.unlink(missing_ok=True)
+        with open(gz_path, 'wb') as f:
+            f.write(gz_data)
+        with self._lock:
+            self.files += 1
+
+    def _raise_errors(self):
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise errors[0]
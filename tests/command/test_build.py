@@ -1,9 +1,16 @@
+import os
+
 import pytest
 from unittest.mock import MagicMock, patch, ANY
 from pathlib import Path
 
-from nkssg.command.build import build, draft, serve, prepare_temp_dir, start_server
+from nkssg.command.build import (
+    build, build_staged, draft, serve, prepare_temp_dir, prepare_staging_dir,
+    rebuild, scan_files, start_server, swap_dirs)
+from nkssg.command.new import site as new_site
 from nkssg.structure.config import Config
+from nkssg.structure.archives import Archive
+from nkssg.structure.singles import Single
 
 
 @pytest.fixture
@@ -226,3 +233,234 @@ def test_start_server_cleans_up_on_exception(
         start_server(mock_config, watch_paths, port=8080)
 
     mock_shutil.rmtree.assert_called_once_with(mock_config.public_dir)
+
+
+@patch('nkssg.command.build.build')
+def test_rebuild_uses_incremental_update(mock_build):
+    site = MagicMock()
+    site.update_paths.return_value = True
+
+    assert rebuild(site, {Path('a.html')}, set(), set()) is site
+    site.update_paths.assert_called_once_with({Path('a.html')}, set(), set())
+    mock_build.assert_not_called()
+
+
+@patch('nkssg.command.build.build')
+def test_rebuild_falls_back_to_full_build(mock_build):
+    site = MagicMock()
+    site.update_paths.return_value = False
+
+    assert rebuild(site, set(), {Path('a.html')}, set()) is mock_build.return_value
+    mock_build.assert_called_once_with(site.config)
+
+
+def test_scan_files(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'a.html').write_text('a')
+    (tmp_path / 'b.md').write_text('b')
+
+    files = scan_files([tmp_path / 'sub', tmp_path / 'b.md', tmp_path / 'missing'])
+
+    assert set(files) == {tmp_path / 'sub' / 'a.html', tmp_path / 'b.md'}
+
+
+def test_prepare_staging_dir_links_previous_output(tmp_path):
+    public_dir = tmp_path / 'public'
+    (public_dir / 'sub').mkdir(parents=True)
+    (public_dir / 'sub' / 'index.html').write_text('old')
+    staging_dir = tmp_path / '.public.staging'
+    (staging_dir / 'stale').mkdir(parents=True)
+
+    prepare_staging_dir(staging_dir, public_dir)
+
+    assert not (staging_dir / 'stale').exists()
+    assert (staging_dir / 'sub' / 'index.html').samefile(
+        public_dir / 'sub' / 'index.html')
+
+    prepare_staging_dir(staging_dir)
+    assert list(staging_dir.iterdir()) == []
+
+
+def test_swap_dirs_replaces_public_dir(tmp_path):
+    public_dir = tmp_path / 'public'
+    public_dir.mkdir()
+    (public_dir / 'old.html').write_text('old')
+    (tmp_path / '.public.old-1-2').mkdir()
+    staging_dir = tmp_path / '.public.staging'
+    staging_dir.mkdir()
+    (staging_dir / 'new.html').write_text('new')
+
+    swap_dirs(staging_dir, public_dir).join()
+
+    assert [p.name for p in tmp_path.iterdir()] == ['public']
+    assert [p.name for p in public_dir.iterdir()] == ['new.html']
+
+
+def test_swap_dirs_restores_public_dir_when_move_fails(tmp_path, monkeypatch):
+    public_dir = tmp_path / 'public'
+    public_dir.mkdir()
+    (public_dir / 'old.html').write_text('old')
+    staging_dir = tmp_path / '.public.staging'
+    staging_dir.mkdir()
+
+    rename = os.rename
+
+    def fail_staging(src, dest):
+        if Path(src) == staging_dir:
+            raise OSError('busy')
+        rename(src, dest)
+
+    monkeypatch.setattr(os, 'rename', fail_staging)
+    with pytest.raises(OSError):
+        swap_dirs(staging_dir, public_dir)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        '.public.staging', 'public']
+    assert (public_dir / 'old.html').read_text() == 'old'
+
+
+def test_swap_dirs_does_not_hold_exit(tmp_path):
+    staging_dir = tmp_path / '.public.staging'
+    staging_dir.mkdir()
+
+    thread = swap_dirs(staging_dir, tmp_path / 'public')
+    assert thread.daemon
+    thread.join()
+
+
+@patch('nkssg.command.build.Site')
+def test_build_staged_writes_into_staging_dir(MockSite, tmp_path):
+    config = Config(base_dir=tmp_path)
+    public_dir = config.public_dir
+    public_dir.mkdir()
+    (public_dir / 'kept.html').write_text('kept')
+    seen = {}
+
+    def output():
+        seen['public_dir'] = config.public_dir
+        seen['replace_outputs'] = config.get('replace_outputs')
+        (config.public_dir / 'index.html').write_text('new')
+    MockSite.return_value.output.side_effect = output
+
+    build_staged(config)
+
+    assert seen == {
+        'public_dir': tmp_path / '.public.staging', 'replace_outputs': True}
+    assert config.public_dir == public_dir
+    assert not config.get('replace_outputs')
+    assert sorted(p.name for p in public_dir.iterdir()) == ['index.html', 'kept.html']
+
+    build_staged(config, clean=True)
+    assert sorted(p.name for p in public_dir.iterdir()) == ['index.html']
+
+
+def test_staged_and_in_place_builds_share_output_manifest(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # builds set the class-wide Single.docs_dir
+    monkeypatch.setattr(Single, 'docs_dir', Single.docs_dir)
+    new_site('site')
+    base_dir = tmp_path / 'site'
+    yml = base_dir / 'nkssg.yml'
+    yml.write_text(yml.read_text() + '\noutput:\n  skip_unchanged: true\n')
+    doc = base_dir / 'docs' / 'post' / 'sample.md'
+
+    def run(body, staged):
+        doc.write_text(f'---\ntitle: sample\ndate: 2024-01-01\n---\n{body}\n')
+        config = Config.from_file(yml, mode='build', base_dir=base_dir)
+        (build_staged if staged else build)(config)
+        return ''.join(
+            p.read_text(encoding='UTF-8')
+            for p in config.public_dir.rglob('*.html'))
+
+    assert 'body-one' in run('body-one', staged=False)
+    assert 'body-two' in run('body-two', staged=True)
+
+    html = run('body-one', staged=False)
+    assert 'body-one' in html
+    assert 'body-two' not in html
+
+    html = run('body-two', staged=True)
+    assert 'body-two' in html
+    assert 'body-one' not in html
+
+
+def read_tree(public_dir: Path):
+    return {
+        path.relative_to(public_dir).as_posix(): path.read_bytes()
+        for path in public_dir.rglob('*') if path.is_file()
+    }
+
+
+def test_serve_updates_match_full_build(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Single, 'docs_dir', Single.docs_dir)
+    new_site('site')
+    base_dir = tmp_path / 'site'
+    posts_dir = base_dir / 'docs' / 'post'
+
+    def write_post(name, title, date, tag):
+        (posts_dir / f'{name}.md').write_text(
+            f'---\ntitle: {title}\ndate: {date}\ntag: ["{tag}"]\n---\n'
+            f'Body of {name}.\n')
+        return posts_dir / f'{name}.md'
+
+    for i in range(1, 6):
+        write_post(f'post{i}', f'Post {i}', f'2023-0{i}-01', 'tag1')
+
+    def build_site(public_dir):
+        config = Config.from_file(
+            base_dir / 'nkssg.yml', mode='serve', base_dir=base_dir)
+        config.public_dir = public_dir
+        return build(config)
+
+    site = build_site(tmp_path / 'serve')
+    edits = [
+        lambda: ({write_post('post3', 'Renamed', '2023-03-01', 'tag1')}, set(), set()),
+        lambda: ({write_post('post2', 'Post 2', '2024-02-01', 'tag1')}, set(), set()),
+        lambda: ({write_post('post4', 'Post 4', '2023-04-01', 'tag3')}, set(), set()),
+        lambda: (set(), {write_post('post6', 'Post 6', '2022-06-01', 'tag1')}, set()),
+        lambda: (set(), set(), {posts_dir / 'post1.md'}),
+    ]
+    for i, edit in enumerate(edits):
+        changed, added, deleted = edit()
+        for path in deleted:
+            path.unlink()
+        assert site.update_docs(changed, added, deleted) is True
+
+        full = build_site(tmp_path / f'full{i}')
+        assert read_tree(tmp_path / 'serve') == read_tree(full.config.public_dir)
+
+
+def test_default_theme_archive_pages_read_only_their_slice(
+        tmp_path, monkeypatch, mocker):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Single, 'docs_dir', Single.docs_dir)
+    new_site('site')
+    base_dir = tmp_path / 'site'
+    posts_dir = base_dir / 'docs' / 'post'
+    def write_post(i, body):
+        # a fixed modified date keeps the site key, so only archives
+        # listing the post are affected by a body edit
+        date = f'2023-{i % 12 + 1:02}-{i // 12 + 1:02}'
+        path = posts_dir / f'post{i:02}.md'
+        path.write_text(
+            f'---\ntitle: Post {i}\ndate: {date}\nmodified: {date}\n---\n'
+            f'{body}\n')
+        return path
+
+    for i in range(40):
+        write_post(i, f'Body {i}')
+
+    config = Config.from_file(
+        base_dir / 'nkssg.yml', mode='serve', base_dir=base_dir)
+    config.public_dir = tmp_path / 'public'
+    site = build(config)
+
+    reads = {reads for reads, keys in site.archives.page_keys.values() if keys}
+    assert reads == {frozenset({'paging'})}
+
+    spy = mocker.spy(Archive, 'render_archive_page')
+    assert site.update_docs({write_post(5, 'New body')}) is True
+
+    # the pages listing the post: in the root, the year and the month
+    assert spy.call_count == 3
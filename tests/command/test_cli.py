@@ -49,6 +49,21 @@ def test_cli_build_command_with_short_clean_flag(MockConfig, mock_build_module):
     mock_build_module.build.assert_called_once_with(mock_config_instance, True)
 
 
+@patch('nkssg.__main__.build')
+@patch('nkssg.__main__.Config')
+def test_cli_build_command_with_staged_flag(MockConfig, mock_build_module):
+    mock_config_instance = MagicMock()
+    MockConfig.from_file.return_value = mock_config_instance
+
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ['build', '--staged', '-c'])
+
+    assert result.exit_code == 0, result.output
+    mock_build_module.build_staged.assert_called_once_with(mock_config_instance, True)
+    mock_build_module.build.assert_not_called()
+
+
 @patch('nkssg.__main__.build')
 @patch('nkssg.__main__.Config')
 def test_cli_serve_command_defaults(MockConfig, mock_build_module):
@@ -2,6 +2,7 @@ import pytest
 from unittest.mock import MagicMock
 from pathlib import PurePath
 import datetime
+import random
 
 from nkssg.structure.config import Config, PostTypeConfig, PostTypeConfigManager, TaxonomyConfig, TermConfig, TaxonomyConfigManager
 from nkssg.structure.singles import Single, Singles
@@ -153,3 +154,74 @@ class TestArchives:
         assert len(cat2_archive.singles) == 1
         assert single1 in cat2_archive.singles
         assert single2 not in cat2_archive.singles
+
+    def test_update_singles_all_keeps_order_of_leaf_walk(self):
+        archives = Archives(Config(), MagicMock(spec=Plugins))
+        ids = [
+            '/section/a/x/leaf1', '/section/b/leaf2', '/section/a/leaf3',
+            '/section/a/x/leaf4', '/section/b', '/section/a/x',
+        ]
+        for archive_id in ids:
+            archives.create_archive(PurePath(archive_id))
+
+        rng = random.Random(0)
+        singles = [f'single{i}' for i in range(30)]
+        for archive in archives:
+            if len(archive.id.parts) > 2:
+                archive.singles = rng.sample(singles, rng.randint(0, 8))
+
+        expected = self.reference_singles_all(archives)
+        for archive in archives:
+            archive.singles_all = []
+        archives.update_singles_all()
+
+        assert {
+            archive.id: archive.singles_all for archive in archives
+        } == expected
+
+    @staticmethod
+    def reference_singles_all(archives: Archives):
+        # the original list based walk
+        for archive in archives.archives.values():
+            if len(archive.id.parts) <= 2 or archive.children:
+                continue
+
+            archive.singles_all = archive.singles[:]
+            current_id = archive.id
+            while len(current_id.parts) > 3:
+                current = archives.create_archive(current_id)
+                parent = archives.create_archive(current_id.parent)
+                for single in parent.singles + current.singles_all:
+                    if single not in parent.singles_all:
+                        parent.singles_all.append(single)
+                current_id = current_id.parent
+
+        return {
+            archive.id: archive.singles_all[:] for archive in archives
+        }
+
+    def test_unknown_terms_are_reported_once(self, capsys):
+        config = Config()
+        config.taxonomy = TaxonomyConfigManager()
+        tag_config = TaxonomyConfig(name='tag', slug='tag')
+        tag_config.terms['tag1'] = TermConfig(name='tag1', slug='tag1')
+        config.taxonomy['tag'] = tag_config
+
+        single_list = [
+            MagicMock(spec=Single, archive_list=[], meta={'tag': terms})
+            for terms in (['tag1', 'tag1', 'nope'], 'nope', ['tag1'])
+        ]
+        singles = MagicMock(spec=Singles)
+        singles.__iter__.return_value = iter(single_list)
+
+        archives = Archives(config, MagicMock(spec=Plugins))
+        archives.setup_taxonomy_archives(singles)
+
+        tag1 = archives.archives[PurePath('/taxonomy/tag/tag1')]
+        assert tag1.singles == [single_list[0], single_list[2]]
+        assert single_list[0].archive_list == [tag1]
+        assert single_list[1].meta['tag'] == ['nope']
+
+        output = capsys.readouterr().out
+        assert output.count('tag: nope is not found') == 1
+        assert 'and 1 more' in output
@@ -0,0 +1,151 @@
+import datetime
+import os
+
+import pytest
+
+from nkssg.structure.cache import (
+    FileCache, MetadataIndex, OutputManifest, get_manifest_path)
+from nkssg.structure.config import Config
+from nkssg.structure.static import StaticSync
+
+
+def test_make_key_is_stable_and_order_sensitive():
+    key1 = FileCache.make_key('body', {'toc': {}, 'tables': {}})
+    key2 = FileCache.make_key('body', {'tables': {}, 'toc': {}})
+    key3 = FileCache.make_key({'toc': {}, 'tables': {}}, 'body')
+
+    assert key1 == key2
+    assert key1 != key3
+
+
+def test_get_and_set(tmp_path):
+    cache = FileCache(tmp_path, 'sample')
+    key = FileCache.make_key('content')
+
+    assert cache.get(key) is None
+    cache.set(key, '<p>content</p>')
+    assert cache.get(key) == '<p>content</p>'
+
+    assert (tmp_path / 'sample' / key[:2] / key).is_file()
+    assert cache.hits == 1
+    assert cache.misses == 1
+    assert cache.stats() == 'sample cache: 1 hits, 1 misses'
+
+
+def test_values_persist_between_instances(tmp_path):
+    key = FileCache.make_key('content')
+    FileCache(tmp_path, 'sample').set(key, 'value')
+
+    cache = FileCache(tmp_path, 'sample')
+    assert cache.get(key) == 'value'
+    assert cache.hits == 1
+
+
+def test_output_manifest_skips_unchanged_files(tmp_path):
+    public_dir = tmp_path / 'public'
+    output_path = public_dir / 'a' / 'index.html'
+    manifest = OutputManifest(tmp_path / 'manifest.json', public_dir)
+
+    assert manifest.is_changed(output_path, 'html') is True
+    output_path.parent.mkdir(parents=True)
+    output_path.write_text('html')
+
+    assert manifest.is_changed(output_path, 'html') is False
+    assert manifest.is_changed(output_path, 'new html') is True
+    assert (manifest.written, manifest.skipped) == (2, 1)
+    assert list(manifest.hashes) == ['a/index.html']
+
+
+def test_output_manifest_persists(tmp_path):
+    public_dir = tmp_path / 'public'
+    output_path = public_dir / 'index.html'
+    public_dir.mkdir()
+    output_path.write_text('html')
+
+    manifest = OutputManifest(tmp_path / 'manifest.json', public_dir)
+    manifest.is_changed(output_path, 'html')
+    manifest.save()
+
+    manifest = OutputManifest(tmp_path / 'manifest.json', public_dir)
+    manifest.load()
+    assert manifest.is_changed(output_path, 'html') is False
+
+    output_path.unlink()
+    assert manifest.is_changed(output_path, 'html') is True
+
+
+@pytest.mark.parametrize("mode", ['serve', 'draft'])
+def test_manifests_are_kept_in_memory_for_temporary_public_dirs(tmp_path, mode):
+    config = Config(base_dir=tmp_path)
+    config['mode'] = mode
+    config.public_dir = tmp_path / 'tmp-public'
+    output_path = config.public_dir / 'index.html'
+    output_path.parent.mkdir()
+    output_path.write_text('html')
+
+    assert get_manifest_path(config, 'output') is None
+    manifest = OutputManifest.from_config(config)
+    assert manifest.is_changed(output_path, 'html') is True
+    assert manifest.is_changed(output_path, 'html') is False
+    manifest.save()
+
+    (tmp_path / 'static').mkdir()
+    (tmp_path / 'static' / 'a.css').write_text('a')
+    sync = StaticSync.from_config(config)
+    sync.add_tree(tmp_path / 'static', config.public_dir)
+    assert sync.sync() == [config.public_dir / 'a.css']
+    sync.save()
+
+    assert not config.cache_dir.exists()
+
+
+def test_manifest_path_depends_on_output_root(tmp_path):
+    config = Config(base_dir=tmp_path)
+    config['mode'] = 'build'
+    path = get_manifest_path(config, 'output')
+    assert path.parent == config.cache_dir / 'output'
+
+    config['output_root'] = config.public_dir
+    config.public_dir = tmp_path / '.public.staging'
+    assert get_manifest_path(config, 'output') == path
+
+
+def test_metadata_index_checks_size_and_mtime(tmp_path):
+    doc = tmp_path / 'a.md'
+    doc.write_text('---\ntitle: A\n---\n')
+    index = MetadataIndex(tmp_path / 'index.pickle', 'fp')
+
+    stamp, values = index.get(doc)
+    assert values is None
+    index.set(doc, stamp, {'date': datetime.date(2024, 1, 2)})
+
+    assert index.get(doc) == (stamp, {'date': datetime.date(2024, 1, 2)})
+
+    mtime = doc.stat().st_mtime_ns + 1_000_000_000
+    os.utime(doc, ns=(mtime, mtime))
+    assert index.get(doc)[1] is None
+    assert (index.hits, index.misses) == (1, 2)
+
+
+def test_metadata_index_persists_per_fingerprint(tmp_path):
+    doc = tmp_path / 'a.md'
+    gone = tmp_path / 'gone.md'
+    for path in (doc, gone):
+        path.write_text('text')
+    index_path = tmp_path / 'index.pickle'
+
+    index = MetadataIndex(index_path, 'fp')
+    for path in (doc, gone):
+        stamp, _ = index.get(path)
+        index.set(path, stamp, {'title': path.stem})
+    gone.unlink()
+    index.save()
+
+    index = MetadataIndex(index_path, 'fp')
+    index.load()
+    assert index.get(doc)[1] == {'title': 'a'}
+    assert list(index.entries) == [str(doc)]
+
+    index = MetadataIndex(index_path, 'other')
+    index.load()
+    assert index.entries == {}
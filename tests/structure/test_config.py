@@ -362,3 +362,18 @@ def test_taxonomy_category_config(config):
     assert config.taxonomy['category'].terms['cat211'].parent == 'cat21'
 
     assert config.taxonomy['category'].terms['cat31'].parent == 'cat3'
+
+
+def test_cache_config(config):
+    assert config.cache.enabled is False
+    assert config.cache.use('markdown') is False
+    assert config.cache_dir == config.base_dir / '.nkssg_cache'
+
+    config.update({
+        'cache': {'enabled': True},
+        'directory': {'cache': 'my_cache'},
+    })
+
+    assert config.cache.use('markdown') is True
+    assert config.cache.use('unknown') is False
+    assert config.cache_dir == config.base_dir / 'my_cache'
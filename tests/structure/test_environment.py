@@ -0,0 +1,189 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+import jinja2
+
+from nkssg.structure.environment import (
+    FragmentCacheExtension, TemplateBytecodeCache, TemplateDependencies,
+    TemplateEnvironment, from_content_string, record_dependencies)
+
+
+def test_dependencies_reverse_index():
+    dependencies = TemplateDependencies()
+    dependencies.set('page1', {'main.html', 'partials/a.html'})
+    dependencies.set('page2', {'main.html'})
+
+    assert dependencies.get_pages(['main.html']) == {'page1', 'page2'}
+    assert dependencies.get_pages(['partials/a.html']) == {'page1'}
+    assert dependencies.get_pages(['unknown.html']) == set()
+
+    dependencies.set('page1', {'main.html'})
+    assert dependencies.get_pages(['partials/a.html']) == set()
+
+
+def test_environment_records_includes_and_imports():
+    env = TemplateEnvironment(loader=jinja2.DictLoader({
+        'main.html': '{% include "partials/a.html" %}{{ sc.hello() }}',
+        'partials/a.html': 'a',
+        'import/short-code.html': '{% macro hello() %}hi{% endmacro %}',
+        'other.html': 'other',
+    }))
+    source = '{% import "import/short-code.html" as sc %}'
+
+    with record_dependencies(env, 'page1'):
+        html = env.from_string(source + env.loader.mapping['main.html']).render()
+    with record_dependencies(env, 'page2'):
+        env.get_template('other.html').render()
+    env.get_template('partials/a.html').render()
+
+    assert html == 'ahi'
+    assert env.dependencies.pages['page1'] == {
+        'partials/a.html', 'import/short-code.html'}
+    assert env.dependencies.pages['page2'] == {'other.html'}
+    assert env.dependencies.get_pages(['partials/a.html']) == {'page1'}
+
+
+def test_record_dependencies_with_plain_environment():
+    env = jinja2.Environment()
+    with record_dependencies(env, 'page1') as names:
+        assert names is None
+
+
+def test_find_templates_using():
+    env = TemplateEnvironment(loader=jinja2.DictLoader({
+        'main.html': '{% include "sidebar.html" %}{{ mypage.title }}',
+        'sidebar.html': '{% for page in singles %}{{ page.title }}{% endfor %}',
+        'unused.html': '{{ archives }}',
+    }))
+    env.globals.update(singles=[], archives=[])
+    with record_dependencies(env, 'page1'):
+        env.get_template('main.html').render(mypage={})
+
+    assert env.find_templates_using(['singles', 'archives']) == {'sidebar.html'}
+
+
+def test_bytecode_cache_skips_compilation_on_warm_builds(tmp_path):
+    templates_dir = tmp_path / 'themes'
+    templates_dir.mkdir()
+    (templates_dir / 'main.html').write_text('{% include "part.html" %}')
+    (templates_dir / 'part.html').write_text('part v1')
+
+    def render():
+        bcc = TemplateBytecodeCache(tmp_path / 'cache')
+        env = TemplateEnvironment(
+            loader=jinja2.FileSystemLoader(templates_dir), bytecode_cache=bcc)
+        return env.get_template('main.html').render(), env, bcc
+
+    html, env, bcc = render()
+    assert html == 'part v1'
+    assert env.compile_count == 2
+    assert (bcc.hits, bcc.misses) == (0, 2)
+
+    html, env, bcc = render()
+    assert html == 'part v1'
+    assert env.compile_count == 0
+    assert bcc.stats() == 'templates cache: 2 hits, 0 misses'
+
+    (templates_dir / 'part.html').write_text('part v2')
+    html, env, bcc = render()
+    assert html == 'part v2'
+    assert env.compile_count == 1
+    assert (bcc.hits, bcc.misses) == (1, 1)
+
+
+def test_content_templates_are_reused_in_memory_and_on_disk(tmp_path):
+    source = '{{ 1 + 2 }} {{ name }}'
+
+    def make_env():
+        bcc = TemplateBytecodeCache(tmp_path / 'content', 'content templates')
+        return TemplateEnvironment(content_cache=bcc), bcc
+
+    env, bcc = make_env()
+    template = env.from_cached_string(source)
+    assert template.render(name='a') == '3 a'
+    assert env.from_cached_string(source) is template
+    assert env.compile_count == 1
+    assert (bcc.hits, bcc.misses) == (0, 1)
+
+    env, bcc = make_env()
+    assert env.from_cached_string(source).render(name='b') == '3 b'
+    assert env.compile_count == 0
+    assert bcc.stats() == 'content templates cache: 1 hits, 0 misses'
+
+    assert env.from_cached_string(source + '!').render(name='c') == '3 c!'
+    assert env.compile_count == 1
+
+
+def test_concurrent_first_loads_compile_once(tmp_path):
+    class SlowLoader(jinja2.DictLoader):
+        def get_source(self, environment, template):
+            time.sleep(0.05)
+            return super().get_source(environment, template)
+
+    env = TemplateEnvironment(loader=SlowLoader({'main.html': 'main'}))
+    with ThreadPoolExecutor(8) as executor:
+        htmls = list(executor.map(
+            lambda _: env.get_template('main.html').render(), range(8)))
+    assert htmls == ['main'] * 8
+    assert env.compile_count == 1
+
+    with ThreadPoolExecutor(8) as executor:
+        templates = list(executor.map(
+            lambda _: env.from_cached_string('{{ 1 + 1 }}'), range(8)))
+    assert len(set(templates)) == 1
+    assert env.compile_count == 2
+
+
+def test_prune_removes_content_templates_not_used_since_mark(tmp_path):
+    bcc = TemplateBytecodeCache(tmp_path / 'content', 'content templates')
+    env = TemplateEnvironment(content_cache=bcc)
+    env.from_cached_string('old')
+    env.from_cached_string('kept')
+    for path in (tmp_path / 'content').iterdir():
+        os.utime(path, (0, 0))
+
+    since = bcc.mark()
+    env = TemplateEnvironment(content_cache=bcc)
+    env.from_cached_string('kept')
+    env.from_cached_string('new')
+    assert bcc.prune(since) == 1
+
+    env = TemplateEnvironment(content_cache=bcc)
+    env.from_cached_string('kept')
+    env.from_cached_string('new')
+    assert env.compile_count == 0
+    env.from_cached_string('old')
+    assert env.compile_count == 1
+
+
+def test_from_content_string_with_plain_environment():
+    env = jinja2.Environment()
+    assert from_content_string(env, '{{ 2 * 3 }}').render() == '6'
+
+
+def test_cache_tag_renders_fragment_once_per_key():
+    env = TemplateEnvironment(
+        loader=jinja2.DictLoader({
+            'main.html': '{% cache "nav", lang %}{% include "nav.html" %}'
+                         '{% endcache %}|{{ name }}',
+            'nav.html': '{{ counter() }}',
+        }),
+        extensions=[FragmentCacheExtension],
+    )
+    calls = []
+    env.globals['counter'] = lambda: calls.append(1) or len(calls)
+    template = env.get_template('main.html')
+
+    with record_dependencies(env, 'page1'):
+        assert template.render(lang='en', name='a') == '1|a'
+    with record_dependencies(env, 'page2'):
+        assert template.render(lang='en', name='b') == '1|b'
+    assert template.render(lang='ja', name='c') == '2|c'
+
+    assert env.fragment_cache.hits == 1
+    assert env.fragment_cache.misses == 2
+    assert env.dependencies.pages['page2'] == {'nav.html'}
+
+    env.fragment_cache.clear()
+    assert template.render(lang='en', name='d') == '3|d'
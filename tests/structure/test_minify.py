@@ -0,0 +1,34 @@
+import pytest
+
+from nkssg.structure.minify import minify_html
+
+
+def test_minify_html_drops_indentation_and_comments():
+    html = '<ul>\n    <li>a  b</li>\n\n    <!-- item -->\n    <li>c</li>\n</ul>\n'
+    assert minify_html(html) == '<ul>\n<li>a  b</li>\n<li>c</li>\n</ul>\n'
+
+
+@pytest.mark.parametrize("element", [
+    '<pre>\n    x\n\n    y\n</pre>',
+    '<PRE class="code">\n    <!-- kept -->\n</PRE>',
+    '<textarea name="t">\n    text\n</textarea>',
+    '<script>\n    if (a) {\n        b();\n    }\n</script>',
+    '<style>\n    body {\n        margin: 0;\n    }\n</style>',
+])
+def test_minify_html_keeps_raw_elements(element):
+    html = f'<div>\n    {element}\n</div>'
+    assert minify_html(html) == f'<div>\n{element}\n</div>'
+
+
+def test_minify_html_keeps_conditional_comments_and_similar_tags():
+    html = '<!--[if IE]>\n  <p>ie</p>\n<![endif]-->\n<prefix>\n  x</prefix>'
+    assert minify_html(html) == '<!--[if IE]>\n<p>ie</p>\n<![endif]-->\n<prefix>\nx</prefix>'
+
+
+def test_minify_html_keeps_include_and_license_comments():
+    html = (
+        '<div>\n    <!--#include virtual="/footer.html" -->\n'
+        '    <!--! License\n    MIT -->\n    <!-- dropped -->\n</div>')
+    assert minify_html(html) == (
+        '<div>\n<!--#include virtual="/footer.html" -->\n'
+        '<!--! License\n    MIT -->\n</div>')
@@ -1,8 +1,14 @@
+import copy
+import gzip
+import os
+import pickle
 from pathlib import Path
 import pytest
 
+from nkssg.structure.cache import OutputManifest
 from nkssg.structure.config import Config
 from nkssg.structure.pages import Page
+from nkssg.structure.writer import GzipWriter, OutputWriter
 
 
 @pytest.mark.parametrize("input, expected", [
@@ -103,3 +109,60 @@ def test_url_setup(
 
     assert page.abs_url == expected_abs_url
     assert page.url == expected_url
+
+
+def test_output_skips_unchanged_file(tmp_path):
+    config = Config(base_dir=tmp_path)
+    config['output_manifest'] = OutputManifest(
+        tmp_path / 'manifest.json', config.public_dir)
+
+    page = Page()
+    page.dest_path = Path('a', 'index.html')
+    page.html = '<p>a</p>'
+    output_path = config.public_dir / page.dest_path
+
+    page.output(config)
+    assert output_path.read_text(encoding='UTF-8') == '<p>a</p>'
+    mtime = output_path.stat().st_mtime_ns
+
+    os.utime(output_path, ns=(mtime - 10**9, mtime - 10**9))
+    page.output(config)
+    assert output_path.stat().st_mtime_ns == mtime - 10**9
+
+    page.html = '<p>b</p>'
+    page.output(config)
+    assert output_path.read_text(encoding='UTF-8') == '<p>b</p>'
+
+
+def test_output_gzips_unchanged_file_without_gz(tmp_path):
+    config = Config(base_dir=tmp_path)
+    config['output_manifest'] = OutputManifest(
+        tmp_path / 'manifest.json', config.public_dir)
+
+    page = Page()
+    page.dest_path = Path('b.html')
+    page.html = '<p>b</p>'
+    output_path = config.public_dir / page.dest_path
+    page.output(config)
+
+    # gzip is turned on after the page was written
+    with OutputWriter(gzip_writer=GzipWriter(extensions=['html'])) as writer:
+        config['output_writer'] = writer
+        page.output(config)
+    assert writer.files == 0
+    assert gzip.decompress(
+        output_path.with_name('b.html.gz').read_bytes()) == b'<p>b</p>'
+
+
+def test_page_keeps_plugin_attributes_and_pickles():
+    page = Page()
+    page.title = 'Title'
+    assert not page.__dict__
+
+    page.to_links = ['/a/']
+    assert page.__dict__ == {'to_links': ['/a/']}
+
+    for restored in (pickle.loads(pickle.dumps(page)), copy.copy(page)):
+        assert restored.title == 'Title'
+        assert restored.to_links == ['/a/']
+        assert restored.dest_path == Path('index.html')
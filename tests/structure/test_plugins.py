@@ -127,3 +127,25 @@ class TestPlugins:
         result = plugin_manager.do_action('on_test_action', target=initial_target, extra_data='some_extra_info')
 
         assert result['extra'] == 'some_extra_info'
+
+    def test_get_process_safe(self, mocker):
+        class SafePlugin(DummyPluginA):
+            process_safe = True
+
+        mock_entry_points = mocker.patch('nkssg.structure.plugins.entry_points')
+        mock_entry_points.return_value = [
+            _create_mock_entry_point('safe', SafePlugin),
+            _create_mock_entry_point('plugin_a', DummyPluginA),
+            _create_mock_entry_point('plugin_d', DummyPluginD),
+        ]
+        config = Config()
+        config.update({'plugins': {'safe': {}, 'plugin_d': {}}})
+        plugin_manager = Plugins(config)
+
+        subset = plugin_manager.get_process_safe('on_test_action')
+        assert list(subset.plugins) == ['safe']
+        assert list(plugin_manager.plugins) == ['safe', 'plugin_d']
+
+        config.update({'plugins': {'plugin_a': {}}})
+        plugin_manager = Plugins(config)
+        assert plugin_manager.get_process_safe('on_test_action') is None
@@ -0,0 +1,97 @@
+import datetime
+import threading
+
+import pytest
+
+from nkssg.structure.archives import Archives
+from nkssg.structure.config import Config
+from nkssg.structure.plugins import Plugins
+from nkssg.structure.queries import Queries
+from nkssg.structure.singles import Single, Singles
+
+
+@pytest.fixture
+def queries(tmp_path):
+    original_docs_dir = Single.docs_dir
+    Single.docs_dir = tmp_path / 'docs'
+
+    config = Config(base_dir=tmp_path)
+    config.update({
+        'post_type': {
+            'post': {'archive_type': 'date'},
+            'page': {'archive_type': 'none'},
+        },
+        'taxonomy': {'tag': {'term': ['tag1', 'tag2', 'tag3']}},
+    })
+    config.now = datetime.datetime(2024, 1, 1)
+
+    posts = [
+        ('p1', '2022-05-01', ['tag1']),
+        ('p2', '2023-01-01', ['tag1', 'tag2']),
+        ('p3', '2023-02-01', ['tag2']),
+        ('p4', '2023-02-03', ['tag2']),
+    ]
+    for name, date, tags in posts:
+        path = config.docs_dir / 'post' / f'{name}.md'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f'---\ntitle: {name}\ndate: {date}\ntag: {tags}\n---\n')
+    for name in ('about', 'contact'):
+        path = config.docs_dir / 'page' / f'{name}.md'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f'---\ntitle: {name}\ndate: 2020-01-01\n---\n')
+
+    plugins = Plugins(config)
+    singles = Singles(config, plugins)
+    singles.setup()
+    archives = Archives(config, plugins)
+    archives.setup(singles)
+
+    yield Queries(singles, archives)
+
+    Single.docs_dir = original_docs_dir
+
+
+def titles(pages):
+    return [page.title for page in pages]
+
+
+def test_pages_and_recent(queries):
+    assert titles(queries.pages('page')) == ['about', 'contact']
+    assert titles(queries.recent('post', 3)) == ['p4', 'p3', 'p2']
+    assert queries.recent('page') == ()
+    assert queries.pages('post') is queries.pages('post')
+
+
+def test_terms_sorted_by_count(queries):
+    assert [term.name for term in queries.terms('tag')] == ['tag2', 'tag1']
+    assert [term.name for term in queries.terms('tag', limit=1)] == ['tag2']
+    assert [term.name for term in queries.terms('tag', sort=None)] == ['tag1', 'tag2']
+
+    assert queries.term_count('tag', 'tag2') == 3
+    assert queries.term_count('tag', 'tag3') == 0
+    assert titles(queries.term_pages('tag', 'tag1')) == ['p2', 'p1']
+    assert queries.term_pages('tag', 'unknown') == ()
+
+
+def test_years_with_month_children(queries):
+    years = queries.years('post')
+    assert [year.name for year in years] == ['2023', '2022']
+    assert list(years[0].children) == ['02', '01']
+    assert queries.years('page') == ()
+
+
+def test_term_lookups_on_cold_cache(queries):
+    # term() builds on terms(); calling it first must not deadlock
+    results = {}
+    thread = threading.Thread(target=lambda: results.update(
+        term=queries.term('tag', 'tag1'),
+        count=queries.term_count('tag', 'tag2'),
+        pages=queries.term_pages('tag', 'tag1'),
+    ), daemon=True)
+    thread.start()
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert results['term'].name == 'tag1'
+    assert results['count'] == 3
+    assert titles(results['pages']) == ['p2', 'p1']
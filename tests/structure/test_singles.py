@@ -1,4 +1,5 @@
 import datetime
+import pickle
 from pathlib import Path, PurePath
 import pytest
 import shutil
@@ -7,10 +8,12 @@ import builtins
 import re
 import jinja2
 
+from nkssg.structure.cache import FileCache, MetadataIndex
 from nkssg.structure.config import Config
 from nkssg.structure.pages import Page
 from nkssg.structure.singles import Single, Singles
 from nkssg.structure.archives import Archive
+from nkssg.structure.plugins import Plugins
 from nkssg.structure.themes import Themes
 
 
@@ -180,6 +183,32 @@ This is the content.
     with pytest.raises(ValueError, match="YAML parsing error"):
         Single.parse_front_matter(file_path)
 
+def test_parse_front_matter_keeps_horizontal_rules(tmp_path):
+    content = """---
+title: Rules
+---
+Above
+---
+Below --- inline
+"""
+    file_path = tmp_path / "test.md"
+    file_path.write_text(content, encoding="utf-8")
+
+    meta, doc = Single.parse_front_matter(file_path)
+
+    assert meta == {"title": "Rules"}
+    assert doc == "\nAbove\n---\nBelow --- inline\n"
+
+@pytest.mark.parametrize("doc, expected", [
+    ("---\na: 1\n---\nbody", (4, 9, 12)),
+    ("\n---\n---\n", (5, 5, 8)),
+    ("text\n---\na: 1\n---\n", None),
+    ("---\na: 1\n", None),
+    ("---a\n---\n", None),
+])
+def test_scan_front_matter(doc, expected):
+    assert Single.scan_front_matter(doc) == expected
+
 def test_parse_front_matter_file_not_found():
     non_existent_path = Path("non_existent_file.md")
     with pytest.raises(FileNotFoundError, match="File not found"):
@@ -1185,3 +1214,243 @@ class TestSinglesSetup:
 
         assert page1.prev_page is None
         assert page1.next_page is None
+
+
+class TestMarkdownCache:
+    def test_convert_markdown_without_cache(self, config):
+        assert Single._convert_markdown('**bold**', config) == '<p><strong>bold</strong></p>'
+
+    def test_convert_markdown_uses_cache(self, config, tmp_path, mocker):
+        md_cache = FileCache(tmp_path, 'markdown')
+        config['caches'] = {'markdown': md_cache}
+
+        html = Single._convert_markdown('**bold**', config)
+        assert html == '<p><strong>bold</strong></p>'
+        assert (md_cache.hits, md_cache.misses) == (0, 1)
+
+        mock_markdown = mocker.patch('nkssg.structure.singles.markdown.markdown')
+        html = Single._convert_markdown('**bold**', config)
+        assert html == '<p><strong>bold</strong></p>'
+        assert (md_cache.hits, md_cache.misses) == (1, 1)
+        mock_markdown.assert_not_called()
+
+    def test_markdown_config_changes_cache_key(self, config, tmp_path):
+        md_cache = FileCache(tmp_path, 'markdown')
+        config['caches'] = {'markdown': md_cache}
+
+        Single._convert_markdown('[toc]\n# Title', config)
+        config.markdown = {'toc': {'marker': '[toc]'}}
+        html = Single._convert_markdown('[toc]\n# Title', config)
+
+        assert 'class="toc"' in html
+        assert md_cache.misses == 2
+
+
+class TestSetupInProcesses:
+    @pytest.fixture
+    def process_config(self, tmp_path):
+        original_docs_dir = Single.docs_dir
+        Single.docs_dir = tmp_path / 'docs'
+
+        cfg = Config(base_dir=tmp_path)
+        cfg.update({'post_type': {'post': {}}})
+        cfg.now = datetime.datetime(2024, 1, 1)
+
+        post_dir = cfg.docs_dir / 'post'
+        post_dir.mkdir(parents=True)
+        for i in range(5):
+            (post_dir / f'post{i}.md').write_text(
+                f'---\ntitle: Post {i}\ndate: 2023-01-0{i + 1}\n---\n**Body {i}**\n')
+        (post_dir / 'note.txt').write_text('---\ndate: 2023-02-01\n---\nline1\nline2')
+        (post_dir / 'future.md').write_text('---\ndate: 2030-01-01\n---\nfuture')
+
+        yield cfg
+
+        Single.docs_dir = original_docs_dir
+
+    def get_results(self, singles):
+        return [
+            (page.title, page.date, page.content, page.file_id, page.is_draft)
+            for page in singles
+        ]
+
+    def test_setup_in_processes_matches_serial(self, process_config):
+        serial = Singles(process_config, Plugins(process_config))
+        serial.setup()
+
+        process_config.update({'parallel': {'setup_processes': True, 'workers': 2}})
+        parallel = Singles(process_config, Plugins(process_config))
+        parallel.setup()
+
+        assert len(parallel.pages) == 6
+        assert self.get_results(parallel) == self.get_results(serial)
+        assert parallel.pages[0].next_page is parallel.pages[1]
+
+    def test_unsafe_plugins_run_in_main_process(self, process_config, mocker):
+        process_config.update({'parallel': {'setup_processes': True, 'workers': 2}})
+        plugins = Plugins(process_config)
+        mocker.patch.object(plugins, 'get_process_safe', return_value=None)
+        spy = mocker.spy(plugins, 'do_action')
+
+        singles = Singles(process_config, plugins)
+        singles.setup()
+
+        content_calls = [
+            call for call in spy.call_args_list if call.args[0] == 'on_get_content']
+        assert len(content_calls) == 7
+        note = next(page for page in singles if page.ext == 'txt')
+        assert note.content == '<p>line1<br />\nline2</p>'
+
+
+class TestLazyContent:
+    @pytest.fixture
+    def lazy_config(self, tmp_path):
+        original_docs_dir = Single.docs_dir
+        Single.docs_dir = tmp_path / 'docs'
+
+        cfg = Config(base_dir=tmp_path)
+        cfg.update({'post_type': {'post': {}}})
+        cfg.now = datetime.datetime(2024, 1, 1)
+
+        post_dir = cfg.docs_dir / 'post'
+        post_dir.mkdir(parents=True)
+        for i in range(3):
+            (post_dir / f'post{i}.md').write_text(
+                f'---\ntitle: Post {i}\ndate: 2023-01-0{i + 1}\n---\n**Body {i}**\n')
+
+        yield cfg
+
+        Single.docs_dir = original_docs_dir
+
+    def test_read_front_matter_stops_at_closing_fence(self, tmp_path):
+        file_path = tmp_path / 'test.md'
+        file_path.write_bytes(b'\n---\ntitle: Head\n---\n\xff\xfe not utf-8')
+
+        assert Single.read_front_matter(file_path) == {'title': 'Head'}
+        with pytest.raises(Exception, match='An error occurred while reading'):
+            Single.parse_front_matter(file_path)
+
+    @pytest.mark.parametrize("content", [
+        "no front matter\n---\n",
+        "---\ntitle: unclosed\n",
+        "---\n---\nbody",
+    ])
+    def test_read_front_matter_without_block(self, tmp_path, content):
+        file_path = tmp_path / 'test.md'
+        file_path.write_text(content, encoding='utf-8')
+
+        assert Single.read_front_matter(file_path) == {}
+
+    @pytest.mark.parametrize("content", [
+        "---\na: 1\n---\nbody",
+        "\n\n---\r\na: 1\r\n---  \r\nbody",
+        "  \n---\n---\n",
+        "---a\nb: 2\n---\n",
+        "---\na: 1\n# ----\n---\n---\n",
+    ])
+    def test_read_front_matter_matches_parse(self, tmp_path, content):
+        file_path = tmp_path / 'test.md'
+        file_path.write_bytes(content.encode('utf-8'))
+
+        meta, _ = Single.parse_front_matter(file_path)
+        assert Single.read_front_matter(file_path) == meta
+
+    def test_setup_reads_bodies_on_demand(self, lazy_config, mocker):
+        plugins = Plugins(lazy_config)
+        spy = mocker.spy(plugins, 'do_action')
+
+        singles = Singles(lazy_config, plugins)
+        singles.setup()
+
+        def content_calls():
+            return [call for call in spy.call_args_list
+                    if call.args[0] == 'on_get_content']
+
+        assert {page.title for page in singles} == {'Post 0', 'Post 1', 'Post 2'}
+        assert content_calls() == []
+
+        page = singles.pages[0]
+        page.abs_src_path.write_text('---\ntitle: Edited\n---\n*Edited*\n')
+        assert page.content == '<p><em>Edited</em></p>'
+        assert page.content == '<p><em>Edited</em></p>'
+        assert len(content_calls()) == 1
+
+    def test_content_assigned_before_loading_is_kept(self, lazy_config):
+        singles = Singles(lazy_config, Plugins(lazy_config))
+        singles.setup()
+
+        page = singles.pages[0]
+        page.content = '<p>replaced</p>'
+        assert page.content == '<p>replaced</p>'
+
+    def test_each_single_has_its_own_content_lock(self, lazy_config):
+        singles = Singles(lazy_config, Plugins(lazy_config))
+        singles.setup()
+
+        first, second = singles.pages[:2]
+        assert first._content_lock is not second._content_lock
+
+        with first._content_lock:
+            assert second.content == '<p><strong>Body 1</strong></p>'
+
+        copied = pickle.loads(pickle.dumps(first))
+        assert copied._content_lock is not first._content_lock
+        assert copied.content == ''
+
+
+class TestMetadataIndex:
+    @pytest.fixture
+    def index_config(self, tmp_path):
+        original_docs_dir = Single.docs_dir
+        Single.docs_dir = tmp_path / 'docs'
+
+        cfg = Config(base_dir=tmp_path)
+        cfg.update({'post_type': {'post': {}}, 'cache': {'enabled': True}})
+        cfg.now = datetime.datetime(2024, 1, 1)
+
+        post_dir = cfg.docs_dir / 'post'
+        post_dir.mkdir(parents=True)
+        for i in range(3):
+            (post_dir / f'post{i}.md').write_text(
+                f'---\ntitle: Post {i}\ndate: 2023-01-0{i + 1}\n---\nBody {i}\n')
+
+        yield cfg
+
+        Single.docs_dir = original_docs_dir
+
+    def setup_singles(self, config):
+        config['caches'] = {'metadata': MetadataIndex.from_config(config)}
+        singles = Singles(config, Plugins(config))
+        singles.setup()
+        return singles
+
+    def get_results(self, singles):
+        return [
+            (page.title, page.date, page.slug, page.file_id, page.meta)
+            for page in singles
+        ]
+
+    def test_unchanged_files_are_not_read(self, index_config, mocker):
+        first = self.setup_singles(index_config)
+        assert index_config['caches']['metadata'].misses == 3
+
+        spy = mocker.spy(Single, 'read_front_matter')
+        second = self.setup_singles(index_config)
+
+        assert spy.call_count == 0
+        assert index_config['caches']['metadata'].hits == 3
+        assert self.get_results(second) == self.get_results(first)
+        assert {page.content for page in second} == {
+            '<p>Body 0</p>', '<p>Body 1</p>', '<p>Body 2</p>'}
+
+    def test_changed_file_is_read_again(self, index_config, mocker):
+        self.setup_singles(index_config)
+
+        path = index_config.docs_dir / 'post' / 'post1.md'
+        path.write_text('---\ntitle: Edited title\ndate: 2023-01-02\n---\n')
+
+        spy = mocker.spy(Single, 'read_front_matter')
+        singles = self.setup_singles(index_config)
+
+        assert spy.call_count == 1
+        assert 'Edited title' in [page.title for page in singles]
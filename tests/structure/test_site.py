@@ -1,3 +1,4 @@
+import os
 import time
 from pathlib import Path
 import pytest
@@ -5,7 +6,11 @@ from unittest.mock import MagicMock, patch
 
 import nkssg
 from nkssg.structure.config import Config
+from nkssg.structure.archives import Archive
+from nkssg.structure.pages import Page
+from nkssg.structure.singles import Single
 from nkssg.structure.site import Site
+from nkssg.structure.workers import can_fork
 
 
 @pytest.fixture
@@ -68,7 +73,7 @@ def test_site_initialization(
     ]
 )
 @patch('nkssg.structure.site.Themes')
-def test_is_target(
+def test_static_matcher(
     MockThemes, base_config, rel_path, static_include, static_exclude, expected
 ):
     mock_themes_instance = MockThemes.return_value
@@ -80,7 +85,7 @@ def test_is_target(
     site = Site(base_config)
     site.themes = mock_themes_instance
 
-    assert site.is_target(rel_path) == expected
+    assert site.get_static_matcher()(rel_path) == expected
 
 
 def test_setup_post_types_automatically_adds_from_dir(base_config):
@@ -432,3 +437,417 @@ def test_draft_mode_skips_archives(MockSingles, MockArchives, base_config):
 
     mock_singles.update_htmls.assert_called_once()
     mock_singles.output.assert_called_once()
+
+
+def test_update_templates_rerenders_dependent_pages_only(site_fixture, mocker):
+    config = site_fixture
+    theme_dir = config.themes_dir / 'default'
+    (theme_dir / 'partials').mkdir()
+    date_path = theme_dir / 'partials' / 'date.html'
+    date_path.write_text('date-v1')
+    (theme_dir / 'single.html').write_text(
+        '{{ mypage.title }} {% include "partials/date.html" %}')
+    (theme_dir / 'archive.html').write_text('archive {{ mypage.title }}')
+
+    site = Site(config)
+    site.setup()
+    site.update()
+    site.output()
+
+    single = site.singles.pages[0]
+    assert 'date-v1' in single.html
+    assert config.env.dependencies.pages[single.id] == {
+        'single.html', 'partials/date.html'}
+    assert len(site.archives.pages) > 0
+
+    date_path.write_text('date-v2')
+    mtime = date_path.stat().st_mtime + 10
+    os.utime(date_path, (mtime, mtime))
+
+    spy_single = mocker.spy(Single, 'update_html')
+    spy_archive = mocker.spy(Archive, 'render_archive_page')
+
+    assert site.update_templates({date_path}) is True
+
+    assert spy_single.call_count == 1
+    spy_archive.assert_not_called()
+    output = (config.public_dir / single.dest_path).read_text(encoding='UTF-8')
+    assert output == 'My Test Post Title date-v2'
+
+
+def test_update_templates_requires_full_rebuild(site_fixture):
+    config = site_fixture
+    theme_dir = config.themes_dir / 'default'
+
+    site = Site(config)
+    site.setup()
+    site.update()
+
+    new_template = theme_dir / 'single-post.html'
+    assert site.update_templates(set(), added={new_template}) is False
+    assert site.update_templates({theme_dir / 'default.yml'}) is False
+    assert site.update_templates({config.docs_dir / 'post' / 'a.md'}) is False
+
+
+@pytest.fixture
+def incremental_site(site_fixture):
+    config = site_fixture
+    posts_dir = config.docs_dir / 'post'
+    for f in posts_dir.glob('*.md'):
+        f.unlink()
+    for i in range(1, 4):
+        (posts_dir / f'post{i}.md').write_text(
+            f'---\ntitle: Post {i}\ndate: 2023-01-0{i}\n---\nBody {i}\n')
+
+    theme_dir = config.themes_dir / 'default'
+    (theme_dir / 'single.html').write_text(
+        '{{ mypage.title }}|{{ mypage.content }}'
+        '|{{ mypage.prev_page.title if mypage.prev_page }}')
+    (theme_dir / 'archive.html').write_text(
+        '{% for page in pages %}{{ page.title }},{% endfor %}')
+
+    site = Site(config)
+    site.setup()
+    site.update()
+    site.output()
+    return site
+
+
+def read_output(site, title):
+    single = next(page for page in site.singles if page.title == title)
+    return (site.config.public_dir / single.dest_path).read_text(encoding='UTF-8')
+
+
+def test_update_docs_rerenders_changed_page_only(incremental_site, mocker):
+    site = incremental_site
+    post2 = site.config.docs_dir / 'post' / 'post2.md'
+    post2.write_text('---\ntitle: Post 2\ndate: 2023-01-02\n---\nNew body\n')
+
+    spy_setup = mocker.spy(Single, 'setup')
+    spy_render = mocker.spy(Single, 'update_html')
+
+    assert site.update_docs({post2}) is True
+
+    assert spy_setup.call_count == 1
+    assert spy_render.call_count == 1
+    assert read_output(site, 'Post 2') == 'Post 2|<p>New body</p>|Post 1'
+
+
+def test_update_docs_handles_title_change_in_neighbours(incremental_site, mocker):
+    site = incremental_site
+    post2 = site.config.docs_dir / 'post' / 'post2.md'
+    post2.write_text('---\ntitle: Renamed\ndate: 2023-01-02\n---\nBody 2\n')
+
+    spy_render = mocker.spy(Single, 'update_html')
+
+    assert site.update_docs({post2}) is True
+
+    rendered = {call.args[0].title for call in spy_render.call_args_list}
+    assert rendered == {'Post 1', 'Renamed', 'Post 3'}
+    assert read_output(site, 'Post 3') == 'Post 3|<p>Body 3</p>|Renamed'
+    assert read_output(site, 'Post 1') == 'Post 1|<p>Body 1</p>|'
+
+
+def test_update_docs_adds_and_deletes_pages(incremental_site):
+    site = incremental_site
+    posts_dir = site.config.docs_dir / 'post'
+    old_dest = site.config.public_dir / site.singles.src_paths['post/post1.md'].dest_path
+
+    (posts_dir / 'post1.md').unlink()
+    (posts_dir / 'post4.md').write_text(
+        '---\ntitle: Post 4\ndate: 2023-01-04\n---\nBody 4\n')
+
+    assert site.update_docs(
+        set(), added={posts_dir / 'post4.md'}, deleted={posts_dir / 'post1.md'}) is True
+
+    assert [page.title for page in site.singles] == ['Post 2', 'Post 3', 'Post 4']
+    assert not old_dest.exists()
+    assert read_output(site, 'Post 4') == 'Post 4|<p>Body 4</p>|Post 3'
+    assert read_output(site, 'Post 2') == 'Post 2|<p>Body 2</p>|'
+
+    archive_pages = [page for page in site.archives.pages if 'Post' in page.html]
+    assert [page.html for page in archive_pages] == ['Post 2,Post 3,Post 4,']
+
+
+def test_update_docs_requires_full_rebuild(incremental_site):
+    site = incremental_site
+    docs_dir = site.config.docs_dir
+
+    assert site.update_docs({docs_dir / 'unknown' / 'a.md'}) is False
+    assert site.update_docs({docs_dir / 'a.md'}) is False
+
+
+def test_update_docs_follows_moved_keyword_link_target(incremental_site):
+    site = incremental_site
+    posts_dir = site.config.docs_dir / 'post'
+    post1, post2 = posts_dir / 'post1.md', posts_dir / 'post2.md'
+
+    post1.write_text(
+        '---\ntitle: Post 1\ndate: 2023-01-01\n---\n<a href="post2.md?">next</a>\n')
+    assert site.update_docs({post1}) is True
+    assert 'href="/post-2/"' in read_output(site, 'Post 1')
+
+    post2.write_text(
+        '---\ntitle: Post 2\ndate: 2023-01-02\nslug: moved\n---\nBody 2\n')
+    assert site.update_docs({post2}) is True
+    assert 'href="/moved/"' in read_output(site, 'Post 1')
+
+
+def test_update_docs_rerenders_content_templates(incremental_site):
+    site = incremental_site
+    posts_dir = site.config.docs_dir / 'post'
+    post1 = posts_dir / 'post1.md'
+
+    post1.write_text(
+        '---\ntitle: Post 1\ndate: 2023-01-01\n---\n{{ singles.pages|length }} posts\n')
+    assert site.update_docs({post1}) is True
+    assert read_output(site, 'Post 1') == 'Post 1|<p>3 posts</p>|'
+
+    (posts_dir / 'post9.md').write_text(
+        '---\ntitle: Post 9\ndate: 2023-01-09\n---\nBody 9\n')
+    assert site.update_docs(set(), added={posts_dir / 'post9.md'}) is True
+    assert read_output(site, 'Post 1') == 'Post 1|<p>4 posts</p>|'
+
+
+def test_update_docs_applies_initialize_plugins_to_new_files(incremental_site):
+    site = incremental_site
+    site.config['mode'] = 'serve'
+    site.plugins.plugins['select-pages'].config = {'end': 3}
+    posts_dir = site.config.docs_dir / 'post'
+
+    post4 = posts_dir / 'post4.md'
+    post4.write_text('---\ntitle: Post 4\ndate: 2023-01-04\n---\nBody 4\n')
+    post1 = posts_dir / 'post1.md'
+    post1.write_text('---\ntitle: Post 1\ndate: 2023-01-01\n---\nNew body\n')
+
+    assert site.update_docs({post1}, added={post4}) is True
+
+    titles = [page.title for page in site.singles]
+    assert 'Post 4' not in titles
+    assert read_output(site, 'Post 1') == 'Post 1|<p>New body</p>|'
+
+
+@pytest.mark.skipif(not can_fork(), reason='fork is not available')
+def test_render_processes_match_threads(incremental_site):
+    site = incremental_site
+    expected = {str(page.dest_path): page.html for page in site.singles}
+    expected.update({str(page.dest_path): page.html for page in site.archives.pages})
+
+    config = site.config
+    config.update({'parallel': {'render_processes': True, 'workers': 2}})
+    site = Site(config)
+    site.setup()
+    site.update()
+
+    results = {str(page.dest_path): page.html for page in site.singles}
+    results.update({str(page.dest_path): page.html for page in site.archives.pages})
+    assert results == expected
+
+    single = site.singles.pages[0]
+    assert config.env.dependencies.pages[single.id] == {'single.html'}
+
+
+@pytest.mark.skipif(not can_fork(), reason='fork is not available')
+def test_render_processes_report_stats(incremental_site):
+    config = incremental_site.config
+    (config.themes_dir / 'default' / 'single.html').write_text(
+        '{% cache "title" %}{{ singles.pages|length }}{% endcache %}'
+        '{{ mypage.content }}')
+    for page in ['post1', 'post2']:
+        (config.docs_dir / 'post' / f'{page}.md').write_text(
+            f'---\ntitle: {page}\ndate: 2023-01-01\n---\n{{{{ mypage.title }}}} {page}\n')
+
+    def build(**parallel):
+        config.update({'parallel': parallel, 'cache': {'enabled': True}})
+        site = Site(config)
+        site.setup()
+        site.update()
+        return [
+            stats.hits + stats.misses for stats in (
+                config['caches']['content_templates'],
+                config.env.fragment_cache)
+        ]
+
+    threads = build(render_processes=False)
+    assert threads[0] > 0 and threads[1] > 0
+    assert build(render_processes=True, workers=2) == threads
+
+
+def test_full_build_prunes_unused_content_templates(incremental_site):
+    config = incremental_site.config
+    post1 = config.docs_dir / 'post' / 'post1.md'
+    cache_dir = config.cache_dir / 'content_templates'
+
+    def build(body):
+        post1.write_text(f'---\ntitle: Post 1\ndate: 2023-01-01\n---\n{body}\n')
+        config.update({'cache': {'enabled': True}})
+        site = Site(config)
+        site.setup()
+        site.update()
+        return sorted(path.name for path in cache_dir.glob('__jinja2_*'))
+
+    first = build('{{ mypage.title }} v1')
+    second = build('{{ mypage.title }} v2')
+    assert len(second) == len(first)
+    assert second != first
+    assert build('{{ mypage.title }} v2') == second
+
+
+def test_sitemap_goes_through_output_manifest(incremental_site, mocker):
+    config = incremental_site.config
+    config.update({
+        'sitemap': {'enabled': True, 'max_urls': 2},
+        'output': {'skip_unchanged': True},
+    })
+    config.extra_pages = ['sitemap.xml']
+
+    def build():
+        site = Site(config)
+        site.setup()
+        site.update()
+        site.output()
+        return site
+
+    build()
+    shard = config.public_dir / 'sitemap-1.xml'
+    os.utime(shard, (0, 0))
+    site = build()
+    assert shard.stat().st_mtime == 0
+
+    write_file = mocker.spy(Page, 'write_file')
+    post3 = config.docs_dir / 'post' / 'post3.md'
+    post3.write_text('---\ntitle: Post 3\ndate: 2023-01-03\n---\nNew body\n')
+    assert site.update_docs({post3}) is True
+    sitemap_paths = [
+        call.args[1].name for call in write_file.call_args_list
+        if call.args[1].name.startswith('sitemap')]
+    assert sorted(sitemap_paths) == [
+        'sitemap-1.xml', 'sitemap-2.xml', 'sitemap.xml']
+    assert shard.stat().st_mtime == 0
+
+
+def test_archive_pages_are_rendered_one_task_per_page(incremental_site, mocker):
+    config = incremental_site.config
+    for post_type in config.post_type.values():
+        post_type.limit = 1
+    (config.themes_dir / 'default' / 'archive.html').write_text(
+        '{{ paginator.paged }}/{{ paginator.total_pages }}:'
+        '{% for page in pages %}{{ page.title }}{% endfor %}')
+
+    spy = mocker.spy(Archive, 'render_archive_page')
+    site = Site(config)
+    site.setup()
+    site.update()
+
+    archive = next(
+        archive for archive in site.archives if len(archive.singles) == 3)
+    pages = site.archives.archive_pages[archive.id]
+    assert [page.html for page in pages] == [
+        f'{i + 1}/3:{single.title}' for i, single in enumerate(archive.singles)]
+    assert [page.page_number for page in pages] == [1, 2, 3]
+    assert spy.call_count == len(site.archives.pages)
+    assert site.archives.pages == [
+        page for id in site.archives.archives
+        for page in site.archives.archive_pages.get(id, [])
+    ]
+
+
+def test_update_docs_rerenders_changed_archive_pages_only(incremental_site, mocker):
+    site = incremental_site
+    config = site.config
+    for post_type in config.post_type.values():
+        post_type.limit = 1
+    site = Site(config)
+    site.setup()
+    site.update()
+    site.output()
+
+    post4 = config.docs_dir / 'post' / 'post4.md'
+    post4.write_text('---\ntitle: Post 4\ndate: 2023-01-04\n---\nBody 4\n')
+
+    spy = mocker.spy(Archive, 'render_archive_page')
+    assert site.update_docs(set(), added={post4}) is True
+
+    # the old last page gets a next page, the new page is rendered for the first time
+    assert sorted(call.args[-1] for call in spy.call_args_list) == [2, 3]
+    archive = next(
+        archive for archive in site.archives if len(archive.singles) == 4)
+    pages = site.archives.archive_pages[archive.id]
+    assert [page.html for page in pages] == [
+        f'{single.title},' for single in archive.singles]
+    output = config.public_dir / pages[3].dest_path
+    assert output.read_text(encoding='UTF-8') == 'Post 4,'
+
+
+def test_update_docs_rerenders_archive_reading_totals(incremental_site, mocker):
+    site = incremental_site
+    config = site.config
+    for post_type in config.post_type.values():
+        post_type.limit = 1
+    (config.themes_dir / 'default' / 'archive.html').write_text(
+        '{{ paginator.total_pages }}')
+    site = Site(config)
+    site.setup()
+    site.update()
+
+    post4 = config.docs_dir / 'post' / 'post4.md'
+    post4.write_text('---\ntitle: Post 4\ndate: 2023-01-04\n---\nBody 4\n')
+
+    spy = mocker.spy(Archive, 'render_archive_page')
+    assert site.update_docs(set(), added={post4}) is True
+
+    assert spy.call_count == 4
+    archive = next(
+        archive for archive in site.archives if len(archive.singles) == 4)
+    pages = site.archives.archive_pages[archive.id]
+    assert [page.html for page in pages] == ['4'] * 4
+
+
+@pytest.fixture
+def query_site(incremental_site):
+    config = incremental_site.config
+    config['mode'] = 'serve'
+    (config.docs_dir / 'post' / 'post4.md').write_text(
+        '---\ntitle: Post 4\ndate: 2023-01-04\n---\nBody 4\n')
+    theme_dir = config.themes_dir / 'default'
+    (theme_dir / 'recent.html').write_text(
+        "{% for p in query.recent('post', 10) %}"
+        "{{ p.title }}:{{ p.date.year }},{% endfor %}")
+    return config
+
+
+def test_update_docs_rerenders_templates_reading_query(query_site):
+    config = query_site
+    (config.themes_dir / 'default' / 'single.html').write_text(
+        '{{ mypage.title }}|{% include "recent.html" %}')
+    site = Site(config)
+    site.setup()
+    site.update()
+    site.output()
+
+    post1 = config.docs_dir / 'post' / 'post1.md'
+    post1.write_text('---\ntitle: Renamed\ndate: 2023-01-01\n---\nBody 1\n')
+    assert site.update_docs({post1}) is True
+
+    # post4 is not a neighbour of post1, only its query result changed
+    assert read_output(site, 'Post 4') == (
+        'Post 4|Renamed:2023,Post 2:2023,Post 3:2023,Post 4:2023,')
+
+
+def test_update_docs_refreshes_cached_fragments(query_site):
+    config = query_site
+    (config.themes_dir / 'default' / 'single.html').write_text(
+        '{{ mypage.title }}|'
+        '{% cache "sidebar" %}{% include "recent.html" %}{% endcache %}')
+    site = Site(config)
+    site.setup()
+    site.update()
+    site.output()
+
+    post1 = config.docs_dir / 'post' / 'post1.md'
+    post1.write_text('---\ntitle: Post 1\ndate: 2022-12-01\n---\nBody 1\n')
+    assert site.update_docs({post1}) is True
+
+    expected = 'Post 1:2022,Post 2:2023,Post 3:2023,Post 4:2023,'
+    for page in site.singles:
+        assert read_output(site, page.title) == f'{page.title}|{expected}'
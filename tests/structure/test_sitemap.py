@@ -0,0 +1,82 @@
+import datetime
+import gzip
+from types import SimpleNamespace
+
+from nkssg.structure.config import Config
+from nkssg.structure.sitemap import SitemapWriter, get_lastmod, write_sitemap
+
+
+def test_single_shard_becomes_sitemap_xml(tmp_path):
+    with SitemapWriter(tmp_path, 'https://example.com') as writer:
+        writer.write('https://example.com/a/', '2024-01-02')
+        writer.write('https://example.com/b/?x=1&y=2')
+    names = writer.close()
+
+    assert names == ['sitemap.xml']
+    text = (tmp_path / 'sitemap.xml').read_text()
+    assert text.startswith('<?xml')
+    assert '<urlset' in text and text.endswith('</urlset>\n')
+    assert '<loc>https://example.com/a/</loc>\n<lastmod>2024-01-02</lastmod>' in text
+    assert '<loc>https://example.com/b/?x=1&amp;y=2</loc>' in text
+    assert not (tmp_path / 'sitemap-1.xml').exists()
+
+
+def test_shards_by_url_count_and_size(tmp_path):
+    with SitemapWriter(tmp_path, 'https://example.com/', max_urls=2) as writer:
+        for i in range(5):
+            writer.write(f'https://example.com/{i}/', f'2024-01-0{i + 1}')
+    names = writer.close()
+
+    assert names == ['sitemap.xml', 'sitemap-1.xml', 'sitemap-2.xml', 'sitemap-3.xml']
+    assert (tmp_path / 'sitemap-3.xml').read_text().count('<url>') == 1
+    index = (tmp_path / 'sitemap.xml').read_text()
+    assert '<sitemapindex' in index
+    assert '<loc>https://example.com/sitemap-2.xml</loc>\n<lastmod>2024-01-04</lastmod>' in index
+
+    with SitemapWriter(tmp_path, max_bytes=250) as writer:
+        for i in range(5):
+            writer.write(f'https://example.com/{i}/')
+    names = writer.close()
+
+    assert len(names) > 2
+    for name in names[1:]:
+        assert len((tmp_path / name).read_bytes()) <= 250
+
+
+def test_gzip_shards_and_stale_shards_are_removed(tmp_path):
+    (tmp_path / 'sitemap-7.xml').write_text('old')
+    (tmp_path / 'sitemap-extra.xml').write_text('keep')
+
+    with SitemapWriter(tmp_path, 'https://example.com', compress=True) as writer:
+        writer.write('https://example.com/a/')
+    names = writer.close()
+    data = (tmp_path / 'sitemap-1.xml.gz').read_bytes()
+
+    assert names == ['sitemap.xml', 'sitemap-1.xml.gz']
+    assert '<loc>https://example.com/a/</loc>' in gzip.decompress(data).decode()
+    assert '<loc>https://example.com/sitemap-1.xml.gz</loc>' in \
+        (tmp_path / 'sitemap.xml').read_text()
+    assert not (tmp_path / 'sitemap-7.xml').exists()
+    assert (tmp_path / 'sitemap-extra.xml').exists()
+
+    with SitemapWriter(tmp_path, 'https://example.com', compress=True) as writer:
+        writer.write('https://example.com/a/')
+    writer.close()
+    assert (tmp_path / 'sitemap-1.xml.gz').read_bytes() == data
+
+
+def test_write_sitemap_uses_modified_date(tmp_path):
+    config = Config(base_dir=tmp_path)
+    config.update({'sitemap': {'enabled': True, 'max_urls': 1}})
+    pages = [
+        SimpleNamespace(abs_url='/a/', date=datetime.datetime(2024, 1, 1),
+                        modified=datetime.datetime(2024, 3, 1)),
+        SimpleNamespace(abs_url='/b/', date=datetime.datetime(2024, 2, 1),
+                        modified=None),
+    ]
+
+    assert get_lastmod(pages[1]) == '2024-02-01'
+    assert write_sitemap(config, pages) == [
+        'sitemap.xml', 'sitemap-1.xml', 'sitemap-2.xml']
+    assert '<lastmod>2024-03-01</lastmod>' in \
+        (config.public_dir / 'sitemap-1.xml').read_text()
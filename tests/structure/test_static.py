@@ -0,0 +1,101 @@
+import os
+import shutil
+
+import pytest
+
+from nkssg.structure.static import PathMatcher, StaticSync
+
+
+@pytest.mark.parametrize("rel_path, expected", [
+    ("style.css", True),
+    ("css/theme.css", True),
+    ("css/skip.css", False),
+    ("img/a.png", True),
+    ("index.html", False),
+])
+def test_path_matcher(rel_path, expected):
+    matcher = PathMatcher(['*.css', 'img/*'], ['*/skip.*'])
+    assert matcher(rel_path) == expected
+    assert PathMatcher([], [])(rel_path) is False
+
+
+def make_sync(tmp_path, **kwargs):
+    public_dir = tmp_path / 'public'
+    public_dir.mkdir(exist_ok=True)
+    sync = StaticSync(tmp_path / 'cache' / 'static.json', public_dir, **kwargs)
+    sync.load()
+    sync.add_tree(tmp_path / 'static', public_dir)
+    return sync
+
+
+def test_sync_copies_changed_files_only(tmp_path):
+    static_dir = tmp_path / 'static'
+    (static_dir / 'css').mkdir(parents=True)
+    (static_dir / 'a.txt').write_text('a')
+    (static_dir / 'css' / 'b.css').write_text('b')
+
+    sync = make_sync(tmp_path, workers=2)
+    assert sorted(sync.sync()) == [
+        tmp_path / 'public' / 'a.txt', tmp_path / 'public' / 'css' / 'b.css']
+    sync.save()
+    assert (tmp_path / 'public' / 'css' / 'b.css').read_text() == 'b'
+
+    sync = make_sync(tmp_path)
+    assert sync.sync() == []
+    assert len(sync.unchanged) == 2
+    sync.save()
+
+    (static_dir / 'a.txt').write_text('aa')
+    sync = make_sync(tmp_path)
+    assert sync.sync() == [tmp_path / 'public' / 'a.txt']
+    assert sync.stats() == 'static: 1 copied, 1 unchanged, 0 deleted'
+    assert (tmp_path / 'public' / 'a.txt').read_text() == 'aa'
+
+
+def test_sync_deletes_files_whose_sources_were_removed(tmp_path):
+    static_dir = tmp_path / 'static'
+    static_dir.mkdir()
+    (static_dir / 'a.css').write_text('a')
+    (static_dir / 'b.css').write_text('b')
+
+    sync = make_sync(tmp_path)
+    sync.sync()
+    sync.save()
+    (tmp_path / 'public' / 'a.css.gz').write_bytes(b'')
+    (tmp_path / 'public' / 'page.html').write_text('not copied by the sync')
+
+    (static_dir / 'a.css').unlink()
+    sync = make_sync(tmp_path)
+    sync.sync()
+
+    assert sync.deleted == [tmp_path / 'public' / 'a.css']
+    assert not (tmp_path / 'public' / 'a.css').exists()
+    assert not (tmp_path / 'public' / 'a.css.gz').exists()
+    assert (tmp_path / 'public' / 'b.css').exists()
+    assert (tmp_path / 'public' / 'page.html').exists()
+
+
+def test_sync_copies_again_when_public_dir_is_removed(tmp_path):
+    static_dir = tmp_path / 'static'
+    static_dir.mkdir()
+    (static_dir / 'a.txt').write_text('a')
+
+    sync = make_sync(tmp_path)
+    sync.sync()
+    sync.save()
+
+    shutil.rmtree(tmp_path / 'public')
+    sync = make_sync(tmp_path)
+    assert sync.sync() == [tmp_path / 'public' / 'a.txt']
+    assert (tmp_path / 'public' / 'a.txt').read_text() == 'a'
+
+
+def test_sync_hardlinks_files(tmp_path):
+    static_dir = tmp_path / 'static'
+    static_dir.mkdir()
+    (static_dir / 'a.txt').write_text('a')
+
+    sync = make_sync(tmp_path, hardlink=True)
+    sync.sync()
+
+    assert os.path.samefile(static_dir / 'a.txt', tmp_path / 'public' / 'a.txt')
@@ -194,3 +194,40 @@ def test_lookup_template_full_path(base_config, create_theme_structure):
     found_path = themes.lookup_template(['home.html'], full_path=True)
     expected_path = str(theme_dir / 'pages' / 'home.html').replace('\\', '/')
     assert found_path == expected_path
+
+
+def test_lookup_template_walks_theme_dirs_once(base_config, create_theme_structure, mocker):
+    theme_name = "indexed_theme"
+    create_theme_structure(
+        theme_name, templates={'single.html': 'single', 'partials/a.html': 'a'}
+    )
+    base_config.theme['name'] = theme_name
+
+    themes = Themes(base_config)
+    spy = mocker.spy(Path, 'glob')
+
+    for _ in range(3):
+        assert themes.lookup_template(['missing.html', 'single.html']) == 'single.html'
+        assert themes.lookup_template(['a.html']) == 'partials/a.html'
+        assert themes.lookup_template(['missing.html']) == ''
+
+    assert spy.call_count == 1
+
+
+def test_lookup_template_rebuilds_index_when_dirs_change(
+        base_config, create_theme_structure):
+    theme_dir = create_theme_structure("theme_a", templates={'a.html': 'a'})
+    other_dir = create_theme_structure("theme_b", templates={'a.html': 'b', 'b.html': 'b'})
+    base_config.theme['name'] = "theme_a"
+
+    themes = Themes(base_config)
+    assert themes.lookup_template(['b.html']) == ''
+
+    themes.dirs.insert(0, other_dir)
+    assert themes.lookup_template(['b.html']) == 'b.html'
+    assert themes.lookup_template(['a.html'], full_path=True) == \
+        str(other_dir / 'a.html').replace('\\', '/')
+
+    themes.dirs.remove(other_dir)
+    assert themes.lookup_template(['a.html'], full_path=True) == \
+        str(theme_dir / 'a.html').replace('\\', '/')
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from nkssg.structure.workers import can_fork, map_in_forks
+
+
+pytestmark = pytest.mark.skipif(not can_fork(), reason='fork is not available')
+
+
+class Item:
+    def __init__(self, value):
+        self.value = value
+        self.lock = lambda: None  # not picklable
+
+
+def test_map_in_forks_keeps_order():
+    items = [Item(i) for i in range(20)]
+    results = map_in_forks(lambda item: item.value * 2, items, workers=3)
+    assert results == [i * 2 for i in range(20)]
+
+
+def test_map_in_forks_runs_in_other_processes():
+    pids = map_in_forks(lambda item: os.getpid(), [Item(i) for i in range(4)], 2)
+    assert os.getpid() not in pids
+
+
+def test_map_in_forks_does_not_change_parent_items():
+    items = [Item(1)]
+
+    def func(item):
+        item.value = 100
+        return item.value
+
+    assert map_in_forks(func, items, workers=2) == [100]
+    assert items[0].value == 1
+
+
+def test_map_in_forks_empty():
+    assert map_in_forks(lambda item: item, [], workers=2) == []
+
+
+class Counter:
+    def __init__(self):
+        self.hits = 0
+
+
+def test_map_in_forks_returns_counters_to_parent():
+    counter = Counter()
+
+    def func(item):
+        counter.hits += item.value
+        return item.value
+
+    items = [Item(i) for i in range(10)]
+    assert map_in_forks(func, items, 3, [(counter, 'hits')]) == list(range(10))
+    assert counter.hits == sum(range(10))
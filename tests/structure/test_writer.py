@@ -0,0 +1,106 @@
+import gzip
+
+import pytest
+
+from nkssg.structure.cache import OutputManifest
+from nkssg.structure.writer import GzipWriter, OutputWriter
+
+
+@pytest.mark.parametrize("workers", [0, 3])
+def test_writer_writes_files(tmp_path, workers):
+    with OutputWriter(workers) as writer:
+        for i in range(20):
+            writer.write(tmp_path / f'dir{i % 4}' / f'{i}.html', f'ページ{i}')
+
+    assert (tmp_path / 'dir1' / '5.html').read_text(encoding='UTF-8') == 'ページ5'
+    assert writer.files == 20
+    assert writer.bytes == sum(len(f'ページ{i}'.encode('UTF-8')) for i in range(20))
+    assert writer.stats() == f'output writer: 20 files, {writer.bytes} bytes'
+
+
+def test_writer_creates_each_directory_once(tmp_path, mocker):
+    spy = mocker.spy(type(tmp_path), 'mkdir')
+
+    with OutputWriter(2) as writer:
+        for i in range(10):
+            writer.write(tmp_path / 'a' / f'{i}.html', 'a')
+        writer.write(tmp_path / 'b' / 'index.html', 'b')
+
+    assert spy.call_count == 2
+
+
+def test_writer_flush_waits_for_queue(tmp_path):
+    writer = OutputWriter(2, queue_size=1)
+    writer.start()
+    for i in range(10):
+        writer.write(tmp_path / f'{i}.html', 'a')
+    writer.flush()
+
+    assert len(list(tmp_path.glob('*.html'))) == 10
+    writer.close()
+
+
+def test_writer_raises_write_errors(tmp_path):
+    (tmp_path / 'file').write_text('')
+
+    with pytest.raises(OSError):
+        with OutputWriter(2) as writer:
+            writer._dirs.add(tmp_path / 'file')
+            writer.write(tmp_path / 'file' / 'index.html', 'a')
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_writer_writes_gzip_siblings(tmp_path, workers):
+    gzip_writer = GzipWriter(min_size=10, extensions=['html'], workers=2)
+    with OutputWriter(workers, gzip_writer=gzip_writer) as writer:
+        writer.write(tmp_path / 'a.html', 'a' * 100)
+        writer.write(tmp_path / 'small.html', 'a')
+        writer.write(tmp_path / 'image.png', 'a' * 100)
+        writer.flush()
+        assert (tmp_path / 'a.html.gz').is_file()
+
+    assert gzip.decompress((tmp_path / 'a.html.gz').read_bytes()) == b'a' * 100
+    assert not (tmp_path / 'small.html.gz').exists()
+    assert not (tmp_path / 'image.png.gz').exists()
+    assert gzip_writer.files == 1
+    assert 'gzip: 1 files, 0 unchanged' in writer.stats()
+
+
+def test_gzip_writer_skips_unchanged_and_removes_small(tmp_path):
+    manifest = OutputManifest(tmp_path / 'gzip.json', tmp_path)
+    path = tmp_path / 'style.css'
+    path.write_text('body {}' * 10)
+
+    for _ in range(2):
+        gzip_writer = GzipWriter(min_size=10, extensions=['.CSS'],
+                                 manifest=manifest)
+        gzip_writer.write_file(path)
+        gzip_writer.close()
+    assert gzip_writer.files == 0
+    assert gzip_writer.skipped == 1
+    assert manifest.hashes.keys() == {'style.css.gz'}
+
+    path.write_text('a')
+    gzip_writer = GzipWriter(min_size=10, extensions=['css'], manifest=manifest)
+    gzip_writer.write_file(path)
+    gzip_writer.close()
+    assert not (tmp_path / 'style.css.gz').exists()
+
+
+def test_gzip_writer_raises_errors(tmp_path):
+    gzip_writer = GzipWriter(extensions=['html'])
+    gzip_writer.write_file(tmp_path / 'missing.html')
+    with pytest.raises(FileNotFoundError):
+        gzip_writer.flush()
+    gzip_writer.close()
+
+
+def test_writer_replace_does_not_change_hardlinked_files(tmp_path):
+    (tmp_path / 'old.html').write_text('old')
+    (tmp_path / 'new.html').hardlink_to(tmp_path / 'old.html')
+
+    with OutputWriter(replace=True) as writer:
+        writer.write(tmp_path / 'new.html', 'new')
+
+    assert (tmp_path / 'old.html').read_text() == 'old'
+    assert (tmp_path / 'new.html').read_text() == 'new'